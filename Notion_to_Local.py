@@ -1,134 +1,234 @@
 import json
 import os
 import sys
-import subprocess
-from datetime import datetime, timezone, timedelta
+import time
+import uuid
+from datetime import datetime, timezone
 from helper import *
-
-# Define the GMT+8 timezone
-GMT_PLUS_8 = timezone(timedelta(hours=8))
+import metrics
+from due_dates import normalize_due_date
+
+# Function to build an index of Todoist task names to (task ID, completed)
+def build_todoist_task_index():
+    todoist_task_index = {}
+    # Active tasks take precedence over completed tasks with the same name
+    for task in get_todoist_tasks():
+        todoist_task_index.setdefault(task['content'], (task['id'], False))
+    for task in get_completed_todoist_tasks():
+        todoist_task_index.setdefault(task['content'], (task['task_id'], True))
+    return todoist_task_index
 
 # Function to create a task in Todoist
-def create_todoist_task(task_name):
-    existing_tasks = get_todoist_tasks()
-    completed_tasks = get_completed_todoist_tasks()
-
-    for task in existing_tasks:
-        if task['content'] == task_name:
-            print(f"Task '{task_name}' already exists in Todoist, skipping...")
-            return task['id'], False
-
-    for task in completed_tasks:
-        if task['content'] == task_name:
+def create_todoist_task(task_name, todoist_task_index):
+    if task_name in todoist_task_index:
+        task_id, completed = todoist_task_index[task_name]
+        if completed:
             print(f"Task '{task_name}' is already completed in Todoist, skipping...")
-            return task['task_id'], True
+        else:
+            print(f"Task '{task_name}' already exists in Todoist, skipping...")
+        return task_id, completed
 
-    url = 'https://api.todoist.com/rest/v2/tasks'
+    url = f'{TODOIST_API_URL}/rest/v2/tasks'
     payload = {
         'content': task_name
     }
-    response = requests.post(url, headers=todoist_headers, data=json.dumps(payload))
+    # Todoist creates the task only once per request ID, so the request can be retried
+    headers = dict(todoist_headers, **{'X-Request-Id': str(uuid.uuid4())})
+    response = todoist_session.post(url, headers=headers, data=json.dumps(payload), idempotent=True)
+    invalidate_snapshots('todoist-tasks')
     response.raise_for_status()
     print(f"Task '{task_name}' created successfully in Todoist")
-    return response.json()['id'], False
+    # Record the new task so a duplicate later in this batch is not created again
+    todoist_task_index[task_name] = (response.json()['id'], False)
+    return todoist_task_index[task_name]
 
 # Function to update the "ID" column of a Notion task with the Todoist task ID
 def update_notion_task_id(notion_task_id, todoist_task_id):
-    url = f'https://api.notion.com/v1/pages/{notion_task_id}'
-    payload = {
-        'properties': {
-            'ID': {'number': int(todoist_task_id)}
-        }
-    }
-    response = requests.patch(url, headers=notion_headers, data=json.dumps(payload))
-    response.raise_for_status()
+    # Sent together with any other change to the page at the end of the cycle
+    queue_notion_update(notion_task_id, {'ID': {'number': int(todoist_task_id)}})
+    if 'notion-todoist-ids' in cycle_snapshots:
+        cycle_snapshots['notion-todoist-ids'].add(int(todoist_task_id))
 
 # Function to update the "Done" status of a Notion task
 def update_notion_task_status(notion_task_id, completed):
-    url = f'https://api.notion.com/v1/pages/{notion_task_id}'
-    payload = {
-        'properties': {
-            'Done': {'checkbox': completed}
-        }
-    }
-    response = requests.patch(url, headers=notion_headers, data=json.dumps(payload))
-    response.raise_for_status()
-
-# Main function
-def sync_notion_to_json():
-    notion_tasks = get_notion_tasks()
-
-    if not notion_tasks:
-        return
+    # Sent together with any other change to the page at the end of the cycle
+    queue_notion_update(notion_task_id, {'Done': {'checkbox': completed}})
+
+# Function to get the incremental fetch state from JSON file
+def get_notion_sync_state(file_path='notion_sync_state.json'):
+    try:
+        with open(file_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+# Function to save the incremental fetch state to JSON file
+def save_notion_sync_state(state, file_path='notion_sync_state.json'):
+    save_json_atomically(file_path, state)
+
+# Function to check whether this cycle has to scan the whole database
+def is_full_scan_due(state):
+    if not state.get('high_water_mark') or not state.get('last_full_scan'):
+        return True
+    last_full_scan = datetime.fromisoformat(state['last_full_scan'])
+    return (datetime.now(timezone.utc) - last_full_scan).total_seconds() >= NOTION_FULL_SCAN_INTERVAL
+
+# Main function, pass page_ids to only sync those pages. Returns True if tasks changed
+def sync_notion_to_json(page_ids=None):
+    state = get_notion_sync_state()
+    full_scan = page_ids is None and is_full_scan_due(state)
+    high_water_mark = state.get('high_water_mark')
+    removed_page_ids = set()
+
+    if page_ids is not None:
+        # Fetch just the pages named by webhook events
+        notion_tasks = []
+        with metrics.span('fetch'):
+            pages = run_concurrently(notion_session, get_notion_page, page_ids)
+        for page_id, page in zip(page_ids, pages):
+            if page is None or page['archived']:
+                removed_page_ids.add(page_id)
+            elif is_in_notion_database(page):
+                notion_tasks.append(page)
+    elif full_scan:
+        notion_tasks = iter_notion_tasks()
+    else:
+        # Only fetch rows edited since the newest edit seen so far. Notion rounds
+        # last_edited_time to the minute, so rows from that minute come back again
+        notion_tasks = iter_notion_tasks({
+            'filter': {
+                'timestamp': 'last_edited_time',
+                'last_edited_time': {'on_or_after': high_water_mark}
+            }
+        })
 
     tasks = load_tasks_from_json('tasks.json')
-    tasks_dict = {task['notion-id']: task for task in tasks}
+    tasks_dict = {task.notion_id: task for task in tasks}
+    # Built on the first new Notion task and reused for the rest of the cycle
+    todoist_task_index = None
+
+    # Pages are fetched while they are compared, time spent waiting for them counts as fetch
+    notion_tasks = metrics.FetchTimer(notion_tasks)
+    diff_start = time.perf_counter()
 
     notion_task_ids = set()
+    # Todoist IDs in the ID column, kept for Todoist_to_Local when the whole database is read.
+    # Other reads add the IDs they see to the snapshot already held, so it stays up to date
+    notion_todoist_ids = set() if full_scan else peek_snapshot('notion-todoist-ids', set())
 
     for task in notion_tasks:
         task_id = task['id']
         notion_task_ids.add(task_id)
-        task_name = task['properties']['Name']['title'][0]['text']['content']
-        task_completed = task['properties']['Done']['checkbox']
-        task_due_date = task['properties']['Date']['date']['start'] if task['properties']['Date']['date'] else None
-        task_labels = [label['name'] for label in task['properties']['Type']['multi_select']]
-
-        if task_due_date:
-            # Remove milliseconds from the due date and localize to GMT+8
-            task_due_date = datetime.fromisoformat(task_due_date).replace(microsecond=0).astimezone(GMT_PLUS_8).isoformat()
+        if task['todoist_id'] is not None:
+            notion_todoist_ids.add(task['todoist_id'])
+        if not high_water_mark or task['last_edited_time'] > high_water_mark:
+            high_water_mark = task['last_edited_time']
+        task_name = task['name']
+        task_completed = task['completed']
+        task_due_date = task['due_date']
+        task_labels = task['labels']
+
+        # Skip rows whose Notion fields are unchanged since they were last read
+        task_fingerprint = get_task_fingerprint(task_name, task_completed, task_due_date, task_labels)
+        if task_id in tasks_dict and tasks_dict[task_id].notion_hash == task_fingerprint:
+            continue
+        remember_notion_page(task)
+
+        # Remove milliseconds from the due date and bring it into the configured timezone
+        task_due_date = normalize_due_date(task_due_date)
 
         if task_id in tasks_dict:
             # Update existing task in JSON file
             task_data = tasks_dict[task_id]
             task_changed = False
 
-            if task_data['name'] != task_name:
-                task_data['name'] = task_name
+            if task_data.name != task_name:
+                task_data.name = task_name
                 task_changed = True
 
-            if task_data['completed'] != task_completed:
-                task_data['completed'] = task_completed
+            if task_data.completed != task_completed:
+                task_data.completed = task_completed
                 task_changed = True
 
-            if task_data['due_date'] != task_due_date:
-                task_data['due_date'] = task_due_date
+            if task_data.due_date != task_due_date:
+                task_data.due_date = task_due_date
                 task_changed = True
 
-            if set(task_data['labels']) != set(task_labels):
-                task_data['labels'] = task_labels
+            if set(task_data.labels) != set(task_labels):
+                task_data.labels = task_labels
                 task_changed = True
 
+            task_data.notion_hash = task_fingerprint
             if task_changed:
-                task_data['last_modified'] = datetime.now(timezone.utc).astimezone(GMT_PLUS_8).isoformat()
+                mark_task_changed(task_data, 'notion')
+            else:
+                # Save the new fingerprint, so the page is skipped after a restart too
+                mark_task_dirty(task_data)
 
         else:
             # Create a task in Todoist and get the task ID
-            todoist_task_id, is_completed = create_todoist_task(task_name)
+            if todoist_task_index is None:
+                todoist_task_index = build_todoist_task_index()
+            todoist_task_id, is_completed = create_todoist_task(task_name, todoist_task_index)
             if todoist_task_id is None and is_completed:
                 task_completed = True
                 update_notion_task_status(task_id, True)
             elif todoist_task_id:
                 update_notion_task_id(task_id, todoist_task_id)
+                notion_todoist_ids.add(int(todoist_task_id))
 
-            task_data = {
-                'notion-id': task_id,
-                'todoist-id': todoist_task_id,
-                'name': task_name,
-                'completed': task_completed,
-                'due_date': task_due_date,
-                'labels': task_labels,
-                'last_modified': datetime.now(timezone.utc).astimezone(GMT_PLUS_8).isoformat()
-            }
+            task_data = Task(task_id, todoist_task_id, task_name, task_completed, task_due_date, task_labels, notion_hash=task_fingerprint)
 
             tasks.append(task_data)
-
-    # Mark tasks as deleted if they are not found in the Notion database
-    for task in tasks:
-        if task['notion-id'] not in notion_task_ids:
-            task['deleted'] = True
-            task['last_modified'] = datetime.now(timezone.utc).astimezone(GMT_PLUS_8).isoformat()
-
-    save_tasks_to_json(tasks, 'tasks.json', "Notion")
-
-sync_notion_to_json()
\ No newline at end of file
+            mark_task_changed(task_data, 'notion')
+
+    metrics.observe_span('fetch', notion_tasks.elapsed)
+    metrics.observe_span('diff', time.perf_counter() - diff_start - notion_tasks.elapsed)
+
+    # A full scan with no pages while tasks are kept is more likely a bad read, such as a
+    # wrong database ID or lost access, than every page deleted at once, so nothing is deleted
+    empty_scan = full_scan and not notion_task_ids and any(not task.deleted for task in tasks)
+    if empty_scan:
+        print("Warning: the Notion database returned no tasks, so no local tasks are deleted. Check NOTION_DATABASE_ID and that the integration can still read the database.")
+    elif full_scan:
+        set_snapshot('notion-todoist-ids', notion_todoist_ids)
+
+    # A full scan still goes on, to record when it ran
+    if not full_scan and not notion_task_ids and not removed_page_ids:
+        print("No changes detected from Notion")
+        return False
+
+    # Mark tasks as deleted if their pages were archived or removed
+    for task_id in removed_page_ids:
+        task = tasks_dict.get(task_id)
+        if task and not task.deleted:
+            task.deleted = True
+            mark_task_changed(task, 'notion')
+
+    # Deletions can only be detected by a full scan of the database
+    if full_scan and not empty_scan:
+        # Mark tasks as deleted if they are not found in the Notion database
+        for task in tasks:
+            if task.notion_id not in notion_task_ids and not task.deleted:
+                task.deleted = True
+                mark_task_changed(task, 'notion')
+
+    changed = save_tasks_to_json(tasks, 'tasks.json', "Notion")
+    # Send the Notion changes that the sync of the saved tasks did not already send
+    with metrics.span('push'):
+        flush_notion_updates()
+
+    # A targeted sync may skip older edits, so it must not move the high-water mark
+    if page_ids is not None:
+        return changed
+
+    new_state = dict(state, high_water_mark=high_water_mark)
+    if full_scan:
+        new_state['last_full_scan'] = datetime.now(timezone.utc).isoformat()
+    # Nothing to write when the high-water mark did not move
+    if new_state != state:
+        save_notion_sync_state(new_state)
+    return changed
+
+if __name__ == "__main__":
+    sync_notion_to_json()
@@ -1,11 +1,11 @@
 import subprocess
-import time
 import tkinter as tk
 from tkinter import ttk
 from tkinter.scrolledtext import ScrolledText
 import threading
 import os
 from dotenv import load_dotenv
+from scheduler import AdaptiveInterval, poll_forever
 
 def check_env_variables():
     load_dotenv()  # Load environment variables from .env file
@@ -50,7 +50,8 @@ def check_env_variables():
         window.mainloop()
 
 def run_script(script_name, output_widget):
-    """Run a Python script and display its output in the GUI."""
+    """Run a Python script and display its output in the GUI. Returns True if it changed any tasks."""
+    changed = False
     try:
         process = subprocess.Popen(["python", script_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         while True:
@@ -58,10 +59,12 @@ def run_script(script_name, output_widget):
             if output == '' and process.poll() is not None:
                 break
             if output:
+                if output.startswith("Update from"):
+                    changed = True
                 output_widget.insert(tk.END, output)
                 output_widget.see(tk.END)  # Scroll to the bottom
                 output_widget.update_idletasks()  # Update the GUI
-        return process.poll()
+        return changed
     except subprocess.CalledProcessError as e:
         if e.returncode == 1:
             output_widget.insert(tk.END, "Error: Invalid Notion API token. Please check your NOTION_API_TOKEN environment variable.\n")
@@ -69,24 +72,23 @@ def run_script(script_name, output_widget):
             output_widget.insert(tk.END, "Error: Invalid Notion Database ID. Please check your NOTION_DATABASE_ID environment variable.\n")
         elif e.returncode == 3:
             output_widget.insert(tk.END, "Error: Invalid Todoist API token. Please check your TODOIST_API_TOKEN environment variable.\n")
-        return None
+        return False
 
 def start_services(output_widget):
+    def run_phase(script_name):
+        output_widget.insert(tk.END, f"Running {script_name}...\n")
+        return run_script(script_name, output_widget)
+
+    def report(message):
+        output_widget.insert(tk.END, message + "\n")
+        output_widget.see(tk.END)
+
     try:
-        # Run Notion_to_Local.py
-        output_widget.insert(tk.END, "Running Notion_to_Local.py...\n")
-        result = run_script("Notion_to_Local.py", output_widget)
-        if result is None:
-            return
-        time.sleep(4)
-        
-        # Run Todoist_to_Local.py
-        output_widget.insert(tk.END, "Running Todoist_to_Local.py...\n")
-        result = run_script("Todoist_to_Local.py", output_widget)
-        if result is None:
-            return
-        time.sleep(4)
-        
+        # Poll Notion and Todoist on independent intervals that adapt to how often they change
+        poll_forever([
+            (AdaptiveInterval("Notion"), lambda: run_phase("Notion_to_Local.py")),
+            (AdaptiveInterval("Todoist"), lambda: run_phase("Todoist_to_Local.py")),
+        ], report)
     except KeyboardInterrupt:
         output_widget.insert(tk.END, "Exiting gracefully...\n")
 
@@ -101,7 +103,7 @@ def create_gui():
     output_widget.grid(row=0, column=0, padx=5, pady=5)
     
     def start_services_thread():
-        thread = threading.Thread(target=start_services, args=(output_widget,))
+        thread = threading.Thread(target=start_services, args=(output_widget,), daemon=True)
         thread.start()
     
     start_button = ttk.Button(frame, text="Start", command=start_services_thread)
@@ -1,13 +1,113 @@
 import json
 import os
+import uuid
 from datetime import datetime, timezone
-from dateutil.parser import parse
 from helper import *
+from journal import get_journal
+import metrics
+from due_dates import format_due_date
+
+# Todoist commands waiting to be sent, as (command, task) pairs
+todoist_command_queue = []
+
+# Function to queue a Todoist Sync API command, returns the temp_id of a new item
+def queue_todoist_command(command_type, args, task=None):
+    command = {'type': command_type, 'uuid': str(uuid.uuid4()), 'args': args}
+    if command_type == 'item_add':
+        command['temp_id'] = str(uuid.uuid4())
+    todoist_command_queue.append((command, task))
+    return command.get('temp_id')
+
+# Function to report the outcome of a single Todoist command
+def report_todoist_command(command, task, status):
+    item_id = task.todoist_id if task else command['args'].get('id')
+    if status == 'ok':
+        if command['type'] in ('item_add', 'item_update'):
+            print(f"Task '{task.name}' synced successfully to Todoist")
+        elif command['type'] == 'item_delete':
+            print(f"Task with ID {item_id} deleted successfully from Todoist")
+    elif status.get('http_code') == 404 or status.get('error_tag') == 'ITEM_NOT_FOUND':
+        print(f"Task with ID {item_id} not found in Todoist, skipping {command['type']}.")
+    else:
+        print(f"Todoist {command['type']} failed for task with ID {item_id}: {status.get('error')}")
+
+# Function to send all queued Todoist commands in batches
+def flush_todoist_commands():
+    temp_id_mapping = {}
+    # Notion IDs of the tasks with a command that did not succeed
+    failed_ids = set()
+    while todoist_command_queue:
+        batch = todoist_command_queue[:TODOIST_COMMAND_BATCH_SIZE]
+        del todoist_command_queue[:TODOIST_COMMAND_BATCH_SIZE]
+
+        # Commands may refer to items created by an earlier batch
+        for command, task in batch:
+            if command['args'].get('id') in temp_id_mapping:
+                command['args']['id'] = temp_id_mapping[command['args']['id']]
+
+        # Journal the batch first, so a crash after Todoist applied it can be replayed
+        journal = get_journal()
+        journal.begin([
+            {'key': command['uuid'], 'command': command, 'notion-id': task.notion_id if task else None}
+            for command, task in batch
+        ])
+        result = post_todoist_commands([command for command, task in batch])
+        temp_id_mapping.update(result.get('temp_id_mapping', {}))
+        sync_status = result.get('sync_status', {})
+        journal.finish([command['uuid'] for command, task in batch])
+
+        for command, task in batch:
+            status = sync_status.get(command['uuid'], {'error': 'No status returned'})
+            # Write the new Todoist ID back to the local task
+            if status == 'ok' and command['type'] == 'item_add':
+                task.todoist_id = temp_id_mapping[command['temp_id']]
+            if task and status != 'ok':
+                failed_ids.add(task.notion_id)
+            report_todoist_command(command, task, status)
+
+        # A task is only synced once every command queued for it has succeeded,
+        # so a failed close or reopen is sent again with the rest of the task
+        pending_ids = {task.notion_id for command, task in todoist_command_queue if task}
+        for task in {task.notion_id: task for command, task in batch if task}.values():
+            if task.notion_id not in failed_ids and task.notion_id not in pending_ids:
+                mark_task_synced(task, 'todoist', task.version or 0)
+
+# Function to resend Todoist items a previous run created without saving their IDs
+# Returns the tasks that got their Todoist ID back
+def replay_todoist_journal(tasks):
+    journal = get_journal()
+    pending = journal.get_pending()
+    if not pending:
+        return []
+
+    # Only new items have to be replayed, every other change is still pending on its
+    # stale task and is sent again by this pass with the task's current values
+    tasks_dict = {task.notion_id: task for task in tasks}
+    entries = [
+        entry for entry in pending
+        if entry['command']['type'] == 'item_add' and entry['notion-id'] in tasks_dict and not tasks_dict[entry['notion-id']].todoist_id
+    ]
+    print(f"Replaying {len(entries)} of {len(pending)} unfinished Todoist changes from the journal...")
+
+    replayed_tasks = []
+    for start in range(0, len(entries), TODOIST_COMMAND_BATCH_SIZE):
+        batch = entries[start:start + TODOIST_COMMAND_BATCH_SIZE]
+        # The same uuid lets Todoist skip commands it already applied
+        result = post_todoist_commands([entry['command'] for entry in batch])
+        temp_id_mapping = result.get('temp_id_mapping', {})
+        for entry in batch:
+            if entry['command']['temp_id'] in temp_id_mapping:
+                task = tasks_dict[entry['notion-id']]
+                task.todoist_id = temp_id_mapping[entry['command']['temp_id']]
+                mark_task_dirty(task)
+                replayed_tasks.append(task)
+
+    journal.finish([entry['key'] for entry in pending])
+    return replayed_tasks
 
 # Function to get tasks from local JSON file
 def get_local_tasks(file_path='tasks.json'):
-    with open(file_path, 'r') as file:
-        return json.load(file)
+    return load_tasks_from_json(file_path)
 
 # Function to get last synced time from JSON file
 def get_last_synced_time(file_path='last_synced_time.json'):
@@ -19,20 +119,27 @@ def get_last_synced_time(file_path='last_synced_time.json'):
 
 # Function to save last synced time to JSON file
 def save_last_synced_time(file_path='last_synced_time.json'):
-    data = {'last_synced_time': datetime.now(timezone.utc).isoformat()}
-    with open(file_path, 'w') as file:
-        json.dump(data, file)
+    save_json_atomically(file_path, {'last_synced_time': datetime.now(timezone.utc).isoformat()})
+
+# Function to check whether a task still has changes to sync, last_synced_at is in seconds since the epoch
+def needs_sync(task, last_synced_at):
+    if task.deleted:
+        return True
+    if task.version is not None:
+        return is_task_stale(task, 'notion') or is_task_stale(task, 'todoist')
+    # Tasks saved before versions were tracked fall back to the last synced time
+    return last_synced_at is None or task.modified_at > last_synced_at
 
 # Function to save tasks to local JSON file
-def save_local_tasks(tasks, file_path='tasks.json'):
-    with open(file_path, 'w') as file:
-        json.dump(tasks, file, ensure_ascii=False, indent=2, default=str)
+def save_local_tasks(tasks, file_path='tasks.json', removed_ids=()):
+    write_tasks_to_json(tasks, file_path, removed_ids)
 
 # Function to delete a task in Notion
 def delete_notion_task(task_id):
-    url = f'https://api.notion.com/v1/pages/{task_id}'
+    url = f'{NOTION_API_URL}/pages/{task_id}'
     try:
-        response = requests.patch(url, headers=notion_headers, data=json.dumps({"archived": True}))
+        response = notion_session.patch(url, headers=notion_headers, data=json.dumps({"archived": True}))
+        invalidate_snapshots('notion-todoist-ids')
         response.raise_for_status()
         print(f"Task with ID {task_id} deleted successfully from Notion")
     except requests.exceptions.HTTPError as e:
@@ -43,139 +150,120 @@ def delete_notion_task(task_id):
 
 # Function to delete a task in Todoist
 def delete_todoist_task(task_id):
-    url = f'https://api.todoist.com/rest/v2/tasks/{task_id}'
-    try:
-        response = requests.delete(url, headers=todoist_headers)
-        response.raise_for_status()
-        print(f"Task with ID {task_id} deleted successfully from Todoist")
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            print(f"Task with ID {task_id} not found in Todoist, skipping deletion.")
-        else:
-            raise
+    queue_todoist_command('item_delete', {'id': task_id})
 
 # Function to create or update a task in Notion
 def sync_notion_task(task):
-    # Only sync if task was modified after last synced time
-    last_synced_time = get_last_synced_time()
-    if last_synced_time and task['last_modified'] <= last_synced_time:
-        return
-
-    url = f'https://api.notion.com/v1/pages/{task["notion-id"]}'
     payload = {
         'properties': {
-            'Name': {'title': [{'text': {'content': task['name']}}]},
-            'Done': {'checkbox': task['completed']},
-            'Type': {'multi_select': [{'name': label} for label in task['labels']]}
+            'Name': {'title': [{'text': {'content': task.name}}]},
+            'Done': {'checkbox': task.completed},
+            'Type': {'multi_select': [{'name': label} for label in task.labels]}
         }
     }
-    if task['due_date']:
-        due_date_obj = parse(task['due_date'])
-        if due_date_obj.time() != datetime.min.time():
-            # If time is present, include it
-            payload['properties']['Date'] = {'date': {'start': due_date_obj.isoformat()}}
-        else:
-            # If only date is present, format without time
-            payload['properties']['Date'] = {'date': {'start': due_date_obj.strftime('%Y-%m-%d')}}
+    if task.due_date:
+        # Includes the time unless the task is due at midnight
+        payload['properties']['Date'] = {'date': {'start': format_due_date(task.due_date)}}
     else:
         payload['properties']['Date'] = {'date': None}
 
-    response = requests.patch(url, headers=notion_headers, data=json.dumps(payload))
-    response.raise_for_status()
-    print(f"Task '{task['name']}' synced successfully to Notion")
+    version = task.version or 0
+    def on_sent():
+        mark_task_synced(task, 'notion', version)
+        print(f"Task '{task.name}' synced successfully to Notion")
+    # Merged with other changes to the page and dropped if Notion already has these values
+    queue_notion_update(task.notion_id, payload['properties'], on_sent)
 
 # Function to create or update a task in Todoist
 def sync_todoist_task(task):
-    # Only sync if task was modified after last synced time
-    last_synced_time = get_last_synced_time()
-    if last_synced_time and task['last_modified'] <= last_synced_time:
-        return
-
-    url = f'https://api.todoist.com/rest/v2/tasks/{task["todoist-id"]}' if task['todoist-id'] else 'https://api.todoist.com/rest/v2/tasks'
-    payload = {
-        'content': task['name'],
-        'labels': task['labels']
+    args = {
+        'content': task.name,
+        'labels': task.labels
     }
 
-    if task['due_date']:
-        due_date_obj = parse(task['due_date'])
-        if due_date_obj.time() != datetime.min.time():
+    if task.due_date:
+        due_date = format_due_date(task.due_date)
+        if 'T' in due_date:
             # If time is present, include it
-            payload['due_string'] = due_date_obj.isoformat()
+            args['due'] = {'string': due_date}
         else:
-            # If only date is present, remove due_string
-            payload['due_date'] = due_date_obj.strftime('%Y-%m-%d')
+            # If only date is present, set the date without time
+            args['due'] = {'date': due_date}
     else:
-        payload['due_string'] = "no due date"
+        args['due'] = None
 
-    try:
-        if task['todoist-id']:
-            # Update existing task
-            response = requests.post(url, headers=todoist_headers, data=json.dumps(payload))
-        else:
-            # Create new task
-            response = requests.post('https://api.todoist.com/rest/v2/tasks', headers=todoist_headers, data=json.dumps(payload))
-        response.raise_for_status()
-        print(f"Task '{task['name']}' synced successfully to Todoist")
-
-        # Update the completed status separately
-        if task['completed']:
-            complete_todoist_task(response.json()['id'])
-        else:
-            reopen_todoist_task(response.json()['id'])
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            print(f"Task with ID {task['todoist-id']} not found in Todoist, skipping sync.")
-        else:
-            raise
-        
-# Function to mark a task as completed in Todoist
-def complete_todoist_task(task_id):
-    url = f'https://api.todoist.com/rest/v2/tasks/{task_id}/close'
-    try:
-        response = requests.post(url, headers=todoist_headers)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            print(f"Task with ID {task_id} not found in Todoist, skipping completion.")
-        else:
-            raise
+    if task.todoist_id:
+        # Update existing task
+        item_id = task.todoist_id
+        queue_todoist_command('item_update', dict(args, id=item_id), task)
+    else:
+        # Create new task, later commands refer to it by its temp_id
+        item_id = queue_todoist_command('item_add', args, task)
 
-# Function to reopen a task in Todoist
-def reopen_todoist_task(task_id):
-    url = f'https://api.todoist.com/rest/v2/tasks/{task_id}/reopen'
-    try:
-        response = requests.post(url, headers=todoist_headers)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            print(f"Task with ID {task_id} not found in Todoist, skipping reopening.")
-        else:
-            raise
+    # Update the completed status separately
+    if task.completed:
+        queue_todoist_command('item_close', {'id': item_id}, task)
+    else:
+        queue_todoist_command('item_uncomplete', {'id': item_id}, task)
 
 # Main function to sync tasks from local JSON file to Notion and Todoist
-def sync_local_tasks_to_notion_and_todoist():
+# Pass the changed tasks to only sync those, otherwise every task is checked
+def sync_local_tasks_to_notion_and_todoist(changed_tasks=None):
     tasks = get_local_tasks()
-    tasks_to_keep = []
+    replayed_tasks = replay_todoist_journal(tasks)
+    if changed_tasks is not None:
+        # The replayed tasks still have to be brought up to date
+        changed_tasks = list(changed_tasks) + replayed_tasks
+    # Read the checkpoint once and drop the tasks that are already in sync
+    last_synced_time = get_last_synced_time()
+    last_synced_at = parse_timestamp(last_synced_time) if last_synced_time else None
+    changed_tasks = [task for task in (tasks if changed_tasks is None else changed_tasks) if needs_sync(task, last_synced_at)]
+    tasks_to_update = []
+    deleted_ids = []
+    notion_ids_to_delete = []
 
-    for task in tasks:
-        if task.get('deleted', False):
+    # Only write to the side that has not seen the change yet
+    for task in changed_tasks:
+        if task.deleted:
             # Delete task from Notion and Todoist if marked as deleted
-            if 'notion-id' in task:
-                delete_notion_task(task['notion-id'])
-            if 'todoist-id' in task:
-                delete_todoist_task(task['todoist-id'])
+            deleted_ids.append(task.notion_id)
+            if is_task_stale(task, 'notion'):
+                notion_ids_to_delete.append(task.notion_id)
+            if task.todoist_id and is_task_stale(task, 'todoist'):
+                delete_todoist_task(task.todoist_id)
         else:
-            # Sync task to Notion and Todoist if not marked as deleted
-            sync_notion_task(task)
-            sync_todoist_task(task)
-            tasks_to_keep.append(task)
+            # Sync task to Todoist if not marked as deleted
+            if is_task_stale(task, 'todoist'):
+                sync_todoist_task(task)
+            if is_task_stale(task, 'notion'):
+                tasks_to_update.append(task)
+
+    try:
+        with metrics.span('push'):
+            # Notion pages are independent of each other, so update them concurrently
+            run_concurrently(notion_session, delete_notion_task, notion_ids_to_delete)
+            for task in tasks_to_update:
+                sync_notion_task(task)
+            flush_notion_updates()
+
+            # Send the queued Todoist changes before saving, so new Todoist IDs are kept
+            flush_todoist_commands()
+    except Exception:
+        # Save the progress made so far, tasks that were not synced stay stale and are retried
+        todoist_command_queue.clear()
+        save_local_tasks(tasks)
+        raise
 
-    # Save the updated list of tasks to the local JSON file
-    save_local_tasks(tasks_to_keep)
+    # Remove the deleted tasks and save the changes to the local JSON file
+    if deleted_ids:
+        deleted = set(deleted_ids)
+        tasks[:] = [task for task in tasks if task.notion_id not in deleted]
+    save_local_tasks(tasks, removed_ids=deleted_ids)
 
     # Save the last synced time after syncing all tasks
     save_last_synced_time()
+    get_journal().compact()
 
-# Run the sync function
-sync_local_tasks_to_notion_and_todoist()
+if __name__ == "__main__":
+    # Run the sync function
+    sync_local_tasks_to_notion_and_todoist()
@@ -1,23 +1,22 @@
 import json
 import os
-import subprocess
-import pytz
-from datetime import datetime, timezone, timedelta
+import time
 from helper import *
-
-# Define the GMT+8 timezone
-GMT_PLUS_8 = pytz.timezone('Etc/GMT-8')
+import helper
+import metrics
+from due_dates import normalize_due_date
 
 # Function to create a task in Notion
-def create_notion_task(task_name, task_description, task_due_date, todoist_task_id, notion_tasks_id_dict, task_labels):
+def create_notion_task(task_name, task_description, task_due_date, todoist_task_id, notion_todoist_ids, task_labels):
     # Check if a task with the same ID already exists
-    if int(todoist_task_id) in notion_tasks_id_dict:
+    if int(todoist_task_id) in notion_todoist_ids:
         print(f"Task '{task_name}' already exists in Notion, skipping...")
         return
 
-    url = 'https://api.notion.com/v1/pages'
+    url = f'{NOTION_API_URL}/pages'
     payload = {
-        'parent': {'database_id': NOTION_DATABASE_ID},
+        # Read from helper, where supervisor workers switch it between workspaces
+        'parent': {'database_id': helper.NOTION_DATABASE_ID},
         'properties': {
             'Name': {'title': [{'text': {'content': task_name}}]},
             'Done': {'checkbox': False},
@@ -26,117 +25,152 @@ def create_notion_task(task_name, task_description, task_due_date, todoist_task_
         }
     }
     if task_due_date:
-        if task_due_date.endswith('Z'):
-            due_date_obj = datetime.strptime(task_due_date, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
-        else:
-            due_date_obj = datetime.fromisoformat(task_due_date)
-        
-        if due_date_obj.tzinfo is None:
-            # Assume the local time is in a specific timezone, e.g., GMT+08:00
-            local_tz = GMT_PLUS_8
-            due_date_obj = local_tz.localize(due_date_obj)
-        task_due_date = due_date_obj.astimezone(GMT_PLUS_8).strftime('%Y-%m-%dT%H:%M:%S%z')
-        task_due_date = task_due_date[:-2] + ':' + task_due_date[-2:]
-        payload['properties']['Date'] = {'date': {'start': task_due_date}}
+        payload['properties']['Date'] = {'date': {'start': normalize_due_date(task_due_date)}}
     
-    response = requests.post(url, headers=notion_headers, data=json.dumps(payload))
+    # Notion has no idempotency key, so a server error is not retried: the page may exist already.
+    # The error fails this phase and the next cycle checks the ID column before creating it again
+    response = notion_session.post(url, headers=notion_headers, data=json.dumps(payload))
     response.raise_for_status()
+    # Keep the ID snapshot of this cycle up to date with the new page
+    notion_todoist_ids.add(int(todoist_task_id))
     print(f"Task '{task_name}' created successfully in Notion")
 
-# Main function
+# Function to get the Todoist sync token from JSON file
+def get_todoist_sync_token(file_path='todoist_sync_state.json'):
+    try:
+        with open(file_path, 'r') as file:
+            return json.load(file)['sync_token']
+    except (FileNotFoundError, KeyError):
+        return '*'
+
+# Function to save the Todoist sync token to JSON file
+def save_todoist_sync_token(sync_token, file_path='todoist_sync_state.json'):
+    save_json_atomically(file_path, {'sync_token': sync_token})
+
+# Function to apply a changed Todoist item to a local task, returns True if the task changed
+def apply_todoist_item(task, todoist_task):
+    task_changed = False
+
+    # Only active items are fingerprinted, so a reopened item is always re-read
+    if (todoist_task.get('is_deleted') or todoist_task.get('checked')) and task.todoist_hash is not None:
+        task.todoist_hash = None
+        mark_task_dirty(task)
+
+    # Mark task as deleted if it no longer exists in Todoist
+    if todoist_task.get('is_deleted'):
+        if not task.deleted:
+            task.deleted = True
+            task_changed = True
+        return task_changed
+
+    if todoist_task.get('checked'):
+        if not task.completed:
+            task.completed = True
+            task_changed = True
+        return task_changed
+
+    # Skip items whose Todoist fields are unchanged since they were last read
+    due = todoist_task.get('due') or {}
+    task_fingerprint = get_task_fingerprint(todoist_task['content'], False, due.get('datetime') or due.get('date'), todoist_task['labels'])
+    if task.todoist_hash == task_fingerprint:
+        return False
+    task.todoist_hash = task_fingerprint
+    # Saved even when no synced field changed, so the item is skipped after a restart too
+    mark_task_dirty(task)
+
+    if task.completed:
+        task.completed = False
+        task_changed = True
+    if task.name != todoist_task['content']:
+        task.name = todoist_task['content']
+        task_changed = True
+
+    # Check if 'due' attribute exists and is not None
+    if 'due' in todoist_task and todoist_task['due'] is not None:
+        due = todoist_task['due']
+        due_date = normalize_due_date(due.get('datetime') if 'datetime' in due else due.get('date', ''))
+        if task.due_date != due_date:
+            task.due_date = due_date
+            task_changed = True
+    else:
+        if task.due_date is not None:
+            task.due_date = None
+            task_changed = True
+
+    if set(task.labels) != set(todoist_task['labels']):
+        task.labels = todoist_task['labels']
+        task_changed = True
+
+    return task_changed
+
+# Main function, returns True if tasks changed
 def sync_todoist_to_json():
     tasks = load_tasks_from_json('tasks.json')
-    todoist_tasks = get_todoist_tasks()
-    completed_todoist_tasks = get_completed_todoist_tasks()
-    notion_tasks = get_notion_tasks()
+    sync_token = get_todoist_sync_token()
+    with metrics.span('fetch'):
+        sync_data = sync_todoist_items(sync_token)
+    full_sync = sync_data.get('full_sync', sync_token == '*')
+    todoist_tasks = sync_data.get('items', [])
 
-    # Create dictionaries for quick lookups
-    tasks_dict = {int(task['todoist-id']): task for task in tasks}
-    notion_tasks_id_dict = {task['properties']['ID']['number']: task for task in notion_tasks if 'ID' in task['properties'] and 'number' in task['properties']['ID']}
-    todoist_tasks_dict = {int(task['id']): task for task in todoist_tasks}
-    completed_todoist_tasks_dict = {int(task['task_id']): task for task in completed_todoist_tasks}
+    # Create a dictionary for quick lookups
+    tasks_dict = {int(task.todoist_id): task for task in tasks if task.todoist_id}
 
-    # Create new Notion tasks for Todoist tasks that don't exist in Notion
-    for todoist_task in todoist_tasks:
+    # Create new Notion tasks for Todoist tasks that don't exist in Notion. Items linked to a
+    # local task are in Notion already, so the ID column is only read for unknown items
+    unknown_todoist_tasks = [
+        task for task in todoist_tasks
+        if not task.get('is_deleted') and not task.get('checked') and int(task['id']) not in tasks_dict
+    ]
+    if unknown_todoist_tasks:
+        with metrics.span('fetch'):
+            notion_todoist_ids = get_notion_todoist_ids()
+    new_notion_tasks = []
+    for todoist_task in unknown_todoist_tasks:
         task_name = todoist_task['content']
         task_description = todoist_task.get('description', '')
         todoist_task_id = int(todoist_task['id'])
         todoist_task_labels = todoist_task['labels']
-        if todoist_task_id not in notion_tasks_id_dict:
+        if todoist_task_id not in notion_todoist_ids:
             due = todoist_task.get('due')
-            task_due_date = due.get('datetime') if due and 'datetime' in due else due.get('date') if due else ''
-            if task_due_date:
-                if task_due_date.endswith('Z'):
-                    due_date_obj = datetime.strptime(task_due_date, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
-                else:
-                    due_date_obj = datetime.fromisoformat(task_due_date)
-                
-                if due_date_obj.tzinfo is None:
-                    # Assume the local time is in a specific timezone, e.g., GMT+08:00
-                    local_tz = GMT_PLUS_8
-                    due_date_obj = local_tz.localize(due_date_obj)
-                task_due_date = due_date_obj.astimezone(GMT_PLUS_8).strftime('%Y-%m-%dT%H:%M:%S%z')
-                # Adjust the format to include the colon in the timezone offset
-                task_due_date = task_due_date[:-2] + ':' + task_due_date[-2:]
-            create_notion_task(task_name, task_description, task_due_date, todoist_task_id, notion_tasks_id_dict, todoist_task_labels)
-
-    # Update local JSON file based on Todoist tasks
-    for task in tasks:
-        todoist_task_id = int(task['todoist-id'])
-        task_changed = False
-
-        if todoist_task_id in completed_todoist_tasks_dict:
-            if not task['completed']:
-                task['completed'] = True
-                task_changed = True
-        elif todoist_task_id in todoist_tasks_dict:
-            todoist_task = todoist_tasks_dict[todoist_task_id]
-            if task['completed']:
-                task['completed'] = False
-                task_changed = True
-            if task['name'] != todoist_task['content']:
-                task['name'] = todoist_task['content']
-                task_changed = True
-            
-            # Check if 'due' attribute exists and is not None
-            if 'due' in todoist_task and todoist_task['due'] is not None:
-                due = todoist_task['due']
-                due_date = due.get('datetime') if 'datetime' in due else due.get('date', '')
-                if due_date:
-                    if due_date.endswith('Z'):
-                        due_date_obj = datetime.strptime(due_date, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
-                    else:
-                        due_date_obj = datetime.fromisoformat(due_date)
-                    
-                    if due_date_obj.tzinfo is None:
-                        # Assume the local time is in a specific timezone, e.g., GMT+08:00
-                        local_tz = GMT_PLUS_8
-                        due_date_obj = local_tz.localize(due_date_obj)
-                    due_date = due_date_obj.astimezone(GMT_PLUS_8).strftime('%Y-%m-%dT%H:%M:%S%z')
-                    # Adjust the format to include the colon in the timezone offset
-                    due_date = due_date[:-2] + ':' + due_date[-2:]
-                if task['due_date'] != due_date:
-                    task['due_date'] = due_date
-                    task_changed = True
-            else:
-                if task['due_date'] is not None:
-                    task['due_date'] = None
-                    task_changed = True
-        
-            if set(task['labels']) != set(todoist_task['labels']):
-                task['labels'] = todoist_task['labels']
-                task_changed = True
-
-        # Mark task as deleted if it no longer exists in Todoist
-        if todoist_task_id not in todoist_tasks_dict and todoist_task_id not in completed_todoist_tasks_dict:
-            if not task['deleted']:
-                task['deleted'] = True
-                task_changed = True
-
-        # Update the last_modified timestamp if the task has changed
-        if task_changed:
-            task['last_modified'] = datetime.now(timezone.utc).isoformat()
-
-    save_tasks_to_json(tasks, 'tasks.json', "Todoist")
-
-sync_todoist_to_json()
\ No newline at end of file
+            task_due_date = normalize_due_date(due.get('datetime') if due and 'datetime' in due else due.get('date') if due else '')
+            new_notion_tasks.append((task_name, task_description, task_due_date, todoist_task_id, notion_todoist_ids, todoist_task_labels))
+
+    # Create the new Notion pages concurrently
+    with metrics.span('push'):
+        run_concurrently(notion_session, lambda args: create_notion_task(*args), new_notion_tasks)
+
+    if full_sync:
+        # A full sync only returns active items, so completed ones are listed separately.
+        # Tasks missing from both lists are deleted, so the list must not be an older snapshot
+        with metrics.span('fetch'):
+            completed_todoist_tasks = fetch_completed_todoist_tasks()
+        set_snapshot('todoist-completed', completed_todoist_tasks)
+        todoist_tasks = todoist_tasks + [{'id': task['task_id'], 'checked': True} for task in completed_todoist_tasks]
+
+    # Update local JSON file based on the changed Todoist tasks
+    diff_start = time.perf_counter()
+    seen_todoist_ids = set()
+    for todoist_task in todoist_tasks:
+        todoist_task_id = int(todoist_task['id'])
+        seen_todoist_ids.add(todoist_task_id)
+        task = tasks_dict.get(todoist_task_id)
+        if task and apply_todoist_item(task, todoist_task):
+            mark_task_changed(task, 'todoist')
+
+    if full_sync:
+        # Mark tasks as deleted if they no longer exist in Todoist
+        for todoist_task_id, task in tasks_dict.items():
+            if todoist_task_id not in seen_todoist_ids and not task.deleted:
+                task.deleted = True
+                mark_task_changed(task, 'todoist')
+
+    metrics.observe_span('diff', time.perf_counter() - diff_start)
+
+    changed = save_tasks_to_json(tasks, 'tasks.json', "Todoist")
+    # Nothing to write when Todoist handed back the same token
+    if sync_data['sync_token'] != sync_token:
+        save_todoist_sync_token(sync_data['sync_token'])
+    return changed
+
+if __name__ == "__main__":
+    sync_todoist_to_json()
@@ -0,0 +1,125 @@
+"""Benchmark due-date normalization against the per-call parsing it replaced.
+
+Normalizes a stream of due strings in the shapes Notion and Todoist send,
+drawn from a pool of distinct values, with the previous routines and with
+the cached ``due_dates`` functions, and checks both give the same results.
+
+    python benchmarks/bench_due_dates.py --strings 1000000 --distinct 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# The previous Notion routine read dates without a time in the machine's timezone
+os.environ['TZ'] = 'Asia/Singapore'
+time.tzset()
+
+import pytz
+from dateutil.parser import parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import due_dates
+
+GMT_PLUS_8 = timezone(timedelta(hours=8))
+PYTZ_GMT_PLUS_8 = pytz.timezone('Etc/GMT-8')
+
+
+def old_todoist_due_date(value):
+    """The routine pasted three times into Todoist_to_Local."""
+    if value.endswith('Z'):
+        due_date_obj = datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+    else:
+        due_date_obj = datetime.fromisoformat(value)
+    if due_date_obj.tzinfo is None:
+        due_date_obj = PYTZ_GMT_PLUS_8.localize(due_date_obj)
+    value = due_date_obj.astimezone(PYTZ_GMT_PLUS_8).strftime('%Y-%m-%dT%H:%M:%S%z')
+    return value[:-2] + ':' + value[-2:]
+
+
+def old_notion_due_date(value):
+    return datetime.fromisoformat(value).replace(microsecond=0).astimezone(GMT_PLUS_8).isoformat()
+
+
+def old_api_due_date(value):
+    """What Sync sent to Notion and Todoist."""
+    due_date_obj = parse(value)
+    if due_date_obj.time() != datetime.min.time():
+        return due_date_obj.isoformat()
+    return due_date_obj.strftime('%Y-%m-%d')
+
+
+def make_pool(distinct, seed):
+    """Build ``distinct`` due strings from each source, as (source, value) pairs."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    pool = []
+    for _ in range(distinct):
+        moment = start + timedelta(minutes=15 * rng.randrange(4 * 24 * 730))
+        shape = rng.randrange(5)
+        if shape == 0:
+            pool.append(('todoist', moment.strftime('%Y-%m-%d')))
+        elif shape == 1:
+            pool.append(('todoist', moment.strftime('%Y-%m-%dT%H:%M:%S')))
+        elif shape == 2:
+            pool.append(('todoist', moment.strftime('%Y-%m-%dT%H:%M:%SZ')))
+        elif shape == 3:
+            pool.append(('notion', moment.strftime('%Y-%m-%dT%H:%M:00.000+08:00')))
+        else:
+            pool.append(('notion', moment.strftime('%Y-%m-%d')))
+    return pool
+
+
+def run_old(stream):
+    for source, value in stream:
+        stored = old_todoist_due_date(value) if source == 'todoist' else old_notion_due_date(value)
+        old_api_due_date(stored)
+
+
+def run_new(stream):
+    for source, value in stream:
+        due_dates.format_due_date(due_dates.normalize_due_date(value))
+
+
+def clear_caches():
+    for function in (due_dates.parse_due_date, due_dates._normalize_due_date, due_dates.format_due_date):
+        function.cache_clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--strings', type=int, default=1000000)
+    parser.add_argument('--distinct', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    pool = make_pool(args.distinct, args.seed)
+    for source, value in pool:
+        old = old_todoist_due_date(value) if source == 'todoist' else old_notion_due_date(value)
+        new = due_dates.normalize_due_date(value)
+        assert old == new, f'{value}: {old} != {new}'
+        assert old_api_due_date(old) == due_dates.format_due_date(new), value
+    rng = random.Random(args.seed)
+    stream = [rng.choice(pool) for _ in range(args.strings)]
+
+    print(f"{'routine':<22} {'total':>9} {'per string':>11}")
+    results = []
+    start = time.perf_counter()
+    run_old(stream)
+    results.append(('previous', time.perf_counter() - start))
+    clear_caches()
+    start = time.perf_counter()
+    run_new(stream)
+    results.append(('due_dates, cold cache', time.perf_counter() - start))
+    start = time.perf_counter()
+    run_new(stream)
+    results.append(('due_dates, warm cache', time.perf_counter() - start))
+    for name, elapsed in results:
+        print(f'{name:<22} {elapsed:>8.2f}s {elapsed / args.strings * 1e9:>8.0f}ns')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark the paginated Notion fetch against a local fake Notion server.
+
+Reports time-to-first-task, total time and peak Python heap for holding
+every raw page with all its properties in a list (``raw list``, as the sync
+did before pages were projected), materialising the projected tasks
+(``get_notion_tasks``) and streaming them (``iter_notion_tasks``).
+
+    python benchmarks/bench_notion_fetch.py --rows 10000 100000 --latency 0.05
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_servers
+
+
+def start_fake_notion(rows, latency):
+    ready = multiprocessing.Queue()
+    notion = fake_servers.ServiceLimiter(latency=latency)
+    process = multiprocessing.Process(target=fake_servers.serve, args=(rows, notion), kwargs={'ready': ready}, daemon=True)
+    process.start()
+    return process, ready.get()
+
+
+def measure(fetch):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_task = None
+    count = 0
+    for _ in fetch():
+        if first_task is None:
+            first_task = time.perf_counter() - start
+        count += 1
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, first_task, total, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated server latency per request, in seconds')
+    args = parser.parse_args()
+
+    os.environ.setdefault('NOTION_API_TOKEN', 'benchmark')
+    os.environ.setdefault('NOTION_DATABASE_ID', fake_servers.DATABASE_ID)
+    # The real rate limit would dominate the timings, the fake server has none
+    os.environ.setdefault('NOTION_RATE_LIMIT', '100000')
+    os.environ.setdefault('NOTION_RATE_BURST', '100000')
+
+    print(f"{'rows':>8} {'mode':<10} {'first task':>11} {'total':>9} {'peak heap':>11}")
+    for rows in args.rows:
+        process, port = start_fake_notion(rows, args.latency)
+        os.environ['NOTION_API_URL'] = f'http://127.0.0.1:{port}/v1'
+        sys.modules.pop('helper', None)
+        import helper
+
+        modes = (
+            ('raw list', lambda: list(helper.iter_notion_pages())),
+            ('list', helper.get_notion_tasks),
+            ('stream', helper.iter_notion_tasks),
+        )
+        for mode, fetch in modes:
+            count, first_task, total, peak = measure(fetch)
+            assert count == rows, f'expected {rows} tasks, got {count}'
+            print(f'{rows:>8} {mode:<10} {first_task * 1000:>9.1f}ms {total:>8.2f}s {peak / 2 ** 20:>9.1f}MB')
+
+        process.terminate()
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark how soon ``python main.py`` sends its first request after it is started.
+
+Runs each command against local fake Notion and Todoist servers from a fresh
+state folder and reports the median time from process start to the first API
+request. One-shot commands are also timed until they exit; the polling loop
+is stopped once its first request arrives.
+
+    python benchmarks/bench_startup.py --runs 5 --commands "" "--once" "notion"
+"""
+import argparse
+import multiprocessing
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import fake_servers
+
+
+def start_fake_servers(tasks):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=fake_servers.serve, args=(tasks,), kwargs={'ready': ready}, daemon=True)
+    process.start()
+    return process, ready.get()
+
+
+def run_command(main, arguments, port, timeout):
+    """Start ``main`` once, returns (seconds to first request, seconds to exit or None, exit code)."""
+    api = f'http://127.0.0.1:{port}'
+    env = dict(
+        os.environ,
+        NOTION_API_URL=f'{api}/v1',
+        TODOIST_API_URL=api,
+        NOTION_DATABASE_ID=fake_servers.DATABASE_ID,
+        NOTION_API_TOKEN='benchmark',
+        TODOIST_API_TOKEN='benchmark',
+    )
+    requests.get(f'{api}/_first_request')
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable, main, *arguments], cwd=tempfile.mkdtemp(prefix='bench-startup-'),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_request = None
+    while first_request is None and time.time() - start < timeout:
+        first_request = requests.get(f'{api}/_first_request').json()['time']
+        if first_request is None:
+            time.sleep(0.002)
+    if first_request is None:
+        process.kill()
+        raise RuntimeError(f'{shlex.join(arguments) or "(no arguments)"} sent no request within {timeout}s')
+
+    exited = None
+    if arguments:
+        process.wait(timeout)
+        exited = time.time() - start
+    else:
+        # The polling loop never exits on its own
+        process.terminate()
+        process.wait()
+    return first_request - start, exited, process.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--main', default=os.path.join(REPO, 'main.py'), help='main.py to start, for comparing with another checkout')
+    parser.add_argument('--commands', nargs='+', default=['', '--once', 'notion', 'todoist'], help='arguments to pass to main.py, "" for none')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    server, port = start_fake_servers(args.tasks)
+    print(f"{'command':<20} {'first request':>14} {'exit':>9}")
+    for command in args.commands:
+        arguments = shlex.split(command)
+        results = [run_command(args.main, arguments, port, args.timeout) for _ in range(args.runs)]
+        first_request = statistics.median(result[0] for result in results)
+        exits = [result[1] for result in results if result[1] is not None]
+        exit_time = f'{statistics.median(exits) * 1000:>7.0f}ms' if exits else f"{'-':>9}"
+        if any(result[2] for result in results if result[1] is not None):
+            exit_time += ' (failed)'
+        print(f"{'main.py ' + command:<20} {first_request * 1000:>12.0f}ms {exit_time}")
+    server.terminate()
+    server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark full and incremental sync cycles against local fake Notion and Todoist servers.
+
+Each workspace size runs in a fresh worker process with its own state
+directory. For every cycle it reports the requests sent to each service,
+wall time, CPU time and the peak RSS of the worker so far.
+
+    python benchmarks/bench_sync.py --tasks 100 10000 100000 --latency 0.01 --rate-limit 50 --error-rate 0.01
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import requests
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import fake_servers
+
+# Fraction of tasks edited on each side before the cycles that pick up edits
+EDIT_FRACTION = 0.01
+
+
+def start_fake_servers(tasks, limiter):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=fake_servers.serve,
+        args=(tasks, fake_servers.ServiceLimiter(**limiter), fake_servers.ServiceLimiter(**limiter)),
+        kwargs={'ready': ready},
+        daemon=True,
+    )
+    process.start()
+    return process, ready.get()
+
+
+def count_requests(counters):
+    notion = sum(count for endpoint, count in counters.items() if ' /v1/' in endpoint)
+    todoist = sum(count for endpoint, count in counters.items() if endpoint.split(' ')[0] != '429' and ' /v1/' not in endpoint)
+    throttled = sum(count for endpoint, count in counters.items() if endpoint.split(' ')[0] == '429')
+    return notion, todoist, throttled
+
+
+def run_cycles(tasks, port, results):
+    """Worker process: run the sync cycles against the fake servers at ``port``."""
+    os.chdir(tempfile.mkdtemp(prefix='bench-sync-'))
+    # Set before the sync modules are imported, so no real account is ever used
+    os.environ.update(
+        NOTION_API_URL=f'http://127.0.0.1:{port}/v1',
+        TODOIST_API_URL=f'http://127.0.0.1:{port}',
+        NOTION_DATABASE_ID=fake_servers.DATABASE_ID,
+        NOTION_API_TOKEN='benchmark',
+        TODOIST_API_TOKEN='benchmark',
+    )
+    # The real rate limits would make large workspaces take hours, use --rate-limit to model them
+    os.environ.setdefault('NOTION_RATE_LIMIT', '100000')
+    os.environ.setdefault('TODOIST_RATE_LIMIT', '100000')
+    os.environ.setdefault('NOTION_RATE_BURST', '100000')
+    os.environ.setdefault('TODOIST_RATE_BURST', '100000')
+
+    from Notion_to_Local import sync_notion_to_json
+    from Sync import sync_local_tasks_to_notion_and_todoist
+    from Todoist_to_Local import sync_todoist_to_json
+
+    api = f'http://127.0.0.1:{port}'
+    edits = max(1, int(tasks * EDIT_FRACTION))
+    cycles = [
+        ('notion full', None, sync_notion_to_json),
+        ('todoist full', None, sync_todoist_to_json),
+        ('notion idle', None, sync_notion_to_json),
+        ('todoist idle', None, sync_todoist_to_json),
+        ('notion edits', {'notion': edits}, sync_notion_to_json),
+        ('todoist edits', {'todoist': edits}, sync_todoist_to_json),
+        ('local pass', None, sync_local_tasks_to_notion_and_todoist),
+    ]
+
+    with open(os.devnull, 'w') as devnull:
+        for name, edit, cycle in cycles:
+            if edit:
+                requests.post(f'{api}/_edit', json=edit).raise_for_status()
+            before = count_requests(requests.get(f'{api}/_stats').json())
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            # The sync prints a line per task, which would drown the report
+            with contextlib.redirect_stdout(devnull):
+                cycle()
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            after = count_requests(requests.get(f'{api}/_stats').json())
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            results.put((name, *(b - a for a, b in zip(before, after)), wall, cpu, peak_rss))
+    results.put(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, nargs='+', default=[100, 10000])
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated server latency per request, in seconds')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='requests per second each fake service accepts before answering 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a random 429')
+    args = parser.parse_args()
+    limiter = dict(latency=args.latency, rate_limit=args.rate_limit, error_rate=args.error_rate)
+
+    # Workers must not inherit the parent's modules or memory
+    context = multiprocessing.get_context('spawn')
+    print(f"{'tasks':>8} {'cycle':<14} {'notion req':>10} {'todoist req':>11} {'429s':>6} {'wall':>9} {'cpu':>9} {'peak rss':>10}")
+    for tasks in args.tasks:
+        server, port = start_fake_servers(tasks, limiter)
+        results = context.Queue()
+        worker = context.Process(target=run_cycles, args=(tasks, port, results))
+        worker.start()
+        for result in iter(results.get, None):
+            name, notion, todoist, throttled, wall, cpu, peak_rss = result
+            print(f'{tasks:>8} {name:<14} {notion:>10} {todoist:>11} {throttled:>6} {wall:>8.2f}s {cpu:>8.2f}s {peak_rss:>8.1f}MB')
+        worker.join()
+        server.terminate()
+        server.join()
+        if worker.exitcode:
+            sys.exit(f'Benchmark worker for {tasks} tasks failed with exit code {worker.exitcode}')
+
+
+if __name__ == '__main__':
+    main()
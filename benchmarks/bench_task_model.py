@@ -0,0 +1,94 @@
+"""Benchmark keeping local tasks as plain dicts versus slotted ``Task`` objects.
+
+Builds a tasks.json of the given sizes in memory, then for each model reports
+the time to load it, the memory and number of allocated blocks still held by
+the loaded tasks, the peak memory while loading, and the time to save them.
+
+    python benchmarks/bench_task_model.py --tasks 10000 100000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_model import Task
+
+
+def make_record(index):
+    """Build the saved form of a task that has been synced both ways."""
+    return {
+        'notion-id': f'00000000-0000-0000-0000-{index:012d}',
+        'todoist-id': str(1000000 + index),
+        'name': f'Task {index}',
+        'completed': index % 3 == 0,
+        'due_date': f'2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T09:30:00+08:00' if index % 2 else None,
+        'labels': ['Work'] if index % 4 == 0 else [],
+        'deleted': False,
+        'last_modified': f'2024-01-01T{index // 3600 % 24:02d}:{index // 60 % 60:02d}:{index % 60:02d}.000000+08:00',
+        'notion-hash': f'{index:032x}',
+        'todoist-hash': f'{index:032x}',
+        'version': 2,
+        'changed-by': 'notion' if index % 2 else 'todoist',
+        'notion-version': 2,
+        'todoist-version': 2,
+    }
+
+
+def load_dicts(data):
+    return json.loads(data)
+
+
+def load_tasks(data):
+    # As JsonTaskStore.load does it
+    return json.loads(data, object_hook=Task.from_dict)
+
+
+def save_dicts(tasks):
+    return json.dumps(tasks, ensure_ascii=False, separators=(',', ':'))
+
+
+def save_tasks(tasks):
+    return json.dumps([task.to_dict() for task in tasks], ensure_ascii=False, separators=(',', ':'))
+
+
+def measure(load, save, data):
+    # Timed without tracing, which slows every allocation down
+    gc.collect()
+    start = time.perf_counter()
+    tasks = load(data)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    save(tasks)
+    save_time = time.perf_counter() - start
+    del tasks
+
+    gc.collect()
+    tracemalloc.start()
+    tasks = load(data)
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    blocks = len(tracemalloc.take_snapshot().traces)
+    tracemalloc.stop()
+    return load_time, held, blocks, peak, save_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'tasks':>8} {'model':<6} {'load':>8} {'held':>9} {'blocks':>9} {'peak':>9} {'save':>8}")
+    for count in args.tasks:
+        data = json.dumps([make_record(index) for index in range(count)])
+        for model, load, save in (('dict', load_dicts, save_dicts), ('Task', load_tasks, save_tasks)):
+            load_time, held, blocks, peak, save_time = measure(load, save, data)
+            print(f'{count:>8} {model:<6} {load_time:>7.2f}s {held / 2 ** 20:>7.1f}MB {blocks:>9} {peak / 2 ** 20:>7.1f}MB {save_time:>7.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+"""Local stand-ins for the Notion and Todoist endpoints used by the sync scripts.
+
+Both services share one in-memory workspace. Rows are kept as compact lists
+and only rendered into full API objects when a response needs them, so a
+100k-task workspace stays small enough to benchmark against.
+
+    python benchmarks/fake_servers.py --tasks 10000 --latency 0.05 --rate-limit 3
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DATABASE_ID = '00000000-0000-0000-0000-00000000d8b0'
+FIRST_TODOIST_ID = 1000000
+
+# Indexes into the compact row lists
+NAME, DONE, DUE, LABELS, TODOIST_ID, EDITED, ARCHIVED = range(7)
+CONTENT, CHECKED, ITEM_DUE, ITEM_LABELS, DELETED, SEQUENCE = range(6)
+
+# Database schema: property IDs and types by name
+NOTION_PROPERTIES = {
+    'Name': ('title', 'title'),
+    'Done': ('done', 'checkbox'),
+    'Date': ('date', 'date'),
+    'Type': ('type', 'multi_select'),
+    'ID': ('todoist', 'number'),
+    # Columns the sync never reads, as most real databases have some
+    'Notes': ('notes', 'rich_text'),
+    'Created': ('created', 'created_time'),
+}
+
+
+def notion_page_id(index):
+    return f'00000000-0000-0000-0000-{index:012d}'
+
+
+def now_iso():
+    # Notion reports last_edited_time rounded down to the minute
+    return datetime.now(timezone.utc).replace(second=0, microsecond=0).strftime('%Y-%m-%dT%H:%M:00.000Z')
+
+
+class FakeWorkspace:
+    """A Notion database and a Todoist project holding the same ``tasks`` tasks."""
+
+    def __init__(self, tasks):
+        self.lock = threading.Lock()
+        self.sequence = 1
+        self.pages = {}
+        self.items = {}
+        first_edit = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for index in range(tasks):
+            # Spread the seeded edits out, so incremental queries return only newer rows
+            edited = (first_edit + timedelta(minutes=index)).strftime('%Y-%m-%dT%H:%M:00.000Z')
+            name = f'Task {index}'
+            done = index % 3 == 0
+            labels = ['Work'] if index % 4 == 0 else []
+            notion_due = f'2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T09:30:00.000+08:00' if index % 2 else None
+            todoist_due = {'date': f'2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T09:30:00', 'is_recurring': False} if index % 2 else None
+            self.pages[notion_page_id(index)] = [name, done, notion_due, labels, FIRST_TODOIST_ID + index, edited, False]
+            self.items[str(FIRST_TODOIST_ID + index)] = [name, done, todoist_due, labels, False, 1]
+        self.next_page = tasks
+        self.next_item = FIRST_TODOIST_ID + tasks
+        # Results of the last database queries by filter, dropped whenever a page changes
+        self.query_results = {}
+        # Results of the Todoist commands already run, by uuid
+        self.processed = {}
+
+    # Notion
+
+    def render_database(self):
+        return {
+            'object': 'database',
+            'id': DATABASE_ID,
+            'properties': {name: {'id': property_id, 'name': name, 'type': kind} for name, (property_id, kind) in NOTION_PROPERTIES.items()},
+        }
+
+    def render_page(self, page_id, property_ids=None):
+        """Render a page, with only the properties in ``property_ids`` when given, like ``filter_properties``."""
+        row = self.pages[page_id]
+        values = {
+            'Name': [{'type': 'text', 'text': {'content': row[NAME], 'link': None}, 'plain_text': row[NAME]}],
+            'Done': row[DONE],
+            'Date': {'start': row[DUE], 'end': None, 'time_zone': None} if row[DUE] else None,
+            'Type': [{'name': label} for label in row[LABELS]],
+            'ID': row[TODOIST_ID],
+            'Notes': [{'type': 'text', 'text': {'content': f'Notes for {row[NAME]}', 'link': None}, 'plain_text': f'Notes for {row[NAME]}'}],
+            'Created': '2024-01-01T00:00:00.000Z',
+        }
+        return {
+            'object': 'page',
+            'id': page_id,
+            'created_time': '2024-01-01T00:00:00.000Z',
+            'last_edited_time': row[EDITED],
+            'archived': row[ARCHIVED],
+            'in_trash': row[ARCHIVED],
+            'parent': {'type': 'database_id', 'database_id': DATABASE_ID},
+            # Built from the schema, so the pages and the database always agree
+            'properties': {
+                name: {'id': property_id, 'type': kind, kind: values[name]}
+                for name, (property_id, kind) in NOTION_PROPERTIES.items()
+                if not property_ids or property_id in property_ids
+            },
+        }
+
+    def query_database(self, payload, property_ids=None):
+        since = ((payload.get('filter') or {}).get('last_edited_time') or {}).get('on_or_after')
+        with self.lock:
+            # Later pages of the same query reuse the filtered list instead of scanning every row again
+            if since not in self.query_results:
+                self.query_results[since] = [page_id for page_id, row in self.pages.items() if not row[ARCHIVED] and (not since or row[EDITED] >= since)]
+            page_ids = self.query_results[since]
+        start = int(payload.get('start_cursor') or 0)
+        end = min(start + min(int(payload.get('page_size') or 100), 100), len(page_ids))
+        with self.lock:
+            results = [self.render_page(page_id, property_ids) for page_id in page_ids[start:end]]
+        has_more = end < len(page_ids)
+        return {'object': 'list', 'results': results, 'next_cursor': str(end) if has_more else None, 'has_more': has_more}
+
+    def apply_properties(self, row, properties, archived=None):
+        if 'Name' in properties:
+            row[NAME] = ''.join(part['text']['content'] for part in properties['Name']['title'])
+        if 'Done' in properties:
+            row[DONE] = properties['Done']['checkbox']
+        if 'Date' in properties:
+            row[DUE] = (properties['Date']['date'] or {}).get('start')
+        if 'Type' in properties:
+            row[LABELS] = [label['name'] for label in properties['Type']['multi_select']]
+        if 'ID' in properties:
+            row[TODOIST_ID] = properties['ID']['number']
+        if archived is not None:
+            row[ARCHIVED] = archived
+        row[EDITED] = now_iso()
+        self.query_results.clear()
+
+    def create_page(self, payload):
+        with self.lock:
+            page_id = notion_page_id(self.next_page)
+            self.next_page += 1
+            self.pages[page_id] = row = ['', False, None, [], None, now_iso(), False]
+            self.apply_properties(row, payload.get('properties', {}))
+            return self.render_page(page_id)
+
+    def update_page(self, page_id, payload):
+        with self.lock:
+            if page_id not in self.pages:
+                return None
+            self.apply_properties(self.pages[page_id], payload.get('properties', {}), payload.get('archived'))
+            return self.render_page(page_id)
+
+    def get_page(self, page_id, property_ids=None):
+        with self.lock:
+            return self.render_page(page_id, property_ids) if page_id in self.pages else None
+
+    def edit_random_pages(self, count):
+        """Rename ``count`` random pages, as if edited in the Notion app."""
+        with self.lock:
+            for page_id in random.sample([page_id for page_id, row in self.pages.items() if not row[ARCHIVED]], count):
+                row = self.pages[page_id]
+                self.apply_properties(row, {'Name': {'title': [{'text': {'content': row[NAME] + ' (edited in Notion)'}}]}})
+
+    # Todoist
+
+    def render_item(self, item_id):
+        row = self.items[item_id]
+        return {
+            'id': item_id,
+            'content': row[CONTENT],
+            'description': '',
+            'checked': row[CHECKED],
+            'is_deleted': row[DELETED],
+            'due': row[ITEM_DUE],
+            'labels': row[ITEM_LABELS],
+        }
+
+    def render_rest_task(self, item_id):
+        item = self.render_item(item_id)
+        due = item['due']
+        if due and 'T' in due['date']:
+            due = {'date': due['date'][:10], 'datetime': due['date'], 'is_recurring': False}
+        return {'id': item_id, 'content': item['content'], 'description': '', 'is_completed': item['checked'], 'labels': item['labels'], 'due': due}
+
+    def touch(self, row):
+        self.sequence += 1
+        row[SEQUENCE] = self.sequence
+
+    def sync(self, payload):
+        with self.lock:
+            response = {}
+            commands = payload.get('commands')
+            if commands:
+                if isinstance(commands, str):
+                    commands = json.loads(commands)
+                response['sync_status'], response['temp_id_mapping'] = self.run_commands(commands)
+            sync_token = payload.get('sync_token')
+            if sync_token is not None:
+                full_sync = sync_token == '*'
+                since = 0 if full_sync else int(sync_token)
+                response['items'] = [
+                    self.render_item(item_id) for item_id, row in self.items.items()
+                    if (not (row[CHECKED] or row[DELETED]) if full_sync else row[SEQUENCE] > since)
+                ]
+                response['full_sync'] = full_sync
+            response['sync_token'] = str(self.sequence)
+            return response
+
+    def run_commands(self, commands):
+        sync_status = {}
+        temp_id_mapping = {}
+        for command in commands:
+            # Todoist does not run a command twice, a repeated uuid gets the first result
+            if command['uuid'] in self.processed:
+                sync_status[command['uuid']], mapping = self.processed[command['uuid']]
+                temp_id_mapping.update(mapping)
+                continue
+            args = dict(command.get('args') or {})
+            item_id = temp_id_mapping.get(args.get('id'), args.get('id'))
+            item_id = str(item_id) if item_id is not None else None
+            if command['type'] == 'item_add':
+                item_id = str(self.next_item)
+                self.next_item += 1
+                self.items[item_id] = [args.get('content', ''), False, None, args.get('labels', []), False, 0]
+                temp_id_mapping[command['temp_id']] = item_id
+                self.update_item(self.items[item_id], args)
+            elif item_id not in self.items or self.items[item_id][DELETED]:
+                sync_status[command['uuid']] = {'error': 'Item not found', 'error_code': 22, 'error_tag': 'ITEM_NOT_FOUND', 'http_code': 404}
+                continue
+            elif command['type'] == 'item_update':
+                self.update_item(self.items[item_id], args)
+            elif command['type'] in ('item_close', 'item_uncomplete', 'item_delete'):
+                row = self.items[item_id]
+                row[CHECKED if command['type'] != 'item_delete' else DELETED] = command['type'] != 'item_uncomplete'
+                self.touch(row)
+            else:
+                sync_status[command['uuid']] = {'error': 'Unknown command', 'error_tag': 'INVALID_COMMAND', 'http_code': 400}
+                continue
+            sync_status[command['uuid']] = 'ok'
+            if command['type'] == 'item_add':
+                self.processed[command['uuid']] = ('ok', {command['temp_id']: item_id})
+            else:
+                self.processed[command['uuid']] = ('ok', {})
+        return sync_status, temp_id_mapping
+
+    def update_item(self, row, args):
+        if 'content' in args:
+            row[CONTENT] = args['content']
+        if 'labels' in args:
+            row[ITEM_LABELS] = args['labels']
+        if 'due' in args:
+            due = args['due']
+            if due is None:
+                row[ITEM_DUE] = None
+            else:
+                row[ITEM_DUE] = {'date': due.get('date') or due.get('string', '')[:19], 'is_recurring': False}
+        self.touch(row)
+
+    def edit_random_items(self, count):
+        """Rename ``count`` random active items, as if edited in the Todoist app."""
+        with self.lock:
+            for item_id in random.sample([item_id for item_id, row in self.items.items() if not (row[CHECKED] or row[DELETED])], count):
+                row = self.items[item_id]
+                self.update_item(row, {'content': row[CONTENT] + ' (edited in Todoist)'})
+
+    def list_active_tasks(self):
+        with self.lock:
+            return [self.render_rest_task(item_id) for item_id, row in self.items.items() if not (row[CHECKED] or row[DELETED])]
+
+    def list_completed_tasks(self):
+        with self.lock:
+            return [{'task_id': item_id, 'content': row[CONTENT]} for item_id, row in self.items.items() if row[CHECKED] and not row[DELETED]]
+
+    def create_rest_task(self, payload):
+        with self.lock:
+            item_id = str(self.next_item)
+            self.next_item += 1
+            self.items[item_id] = [payload.get('content', ''), False, None, payload.get('labels', []), False, 0]
+            self.touch(self.items[item_id])
+            return self.render_rest_task(item_id)
+
+
+class ServiceLimiter:
+    """Per-service latency, rate limit and random 429 injection."""
+
+    def __init__(self, latency=0.0, rate_limit=0.0, error_rate=0.0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.updated = time.monotonic()
+
+    def should_throttle(self):
+        if self.error_rate and random.random() < self.error_rate:
+            return True
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.updated) * self.rate_limit)
+            self.updated = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+
+NOTION_PAGE = re.compile(r'^/v1/pages/([^/]+)$')
+NOTION_QUERY = re.compile(r'^/v1/databases/([^/]+)/query$')
+NOTION_DATABASE = re.compile(r'^/v1/databases/([^/]+)$')
+TODOIST_TASK = re.compile(r'^/rest/v2/tasks/([^/]+)(/close|/reopen)?$')
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    workspace = None
+    limiters = None
+    counters = None
+    first_request = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body=None, headers=()):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_payload(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        return json.loads(body) if body else {}
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        path = url.path
+        payload = self.read_payload() if method in ('POST', 'PATCH') else {}
+        # Control endpoints for benchmarks, not counted as API requests
+        if path == '/_stats':
+            with self.workspace.lock:
+                self.send_json(200, dict(self.counters))
+            return
+        if path == '/_first_request':
+            # Wall-clock time of the first API request since the last call, then forget it
+            with self.workspace.lock:
+                self.send_json(200, {'time': self.first_request.pop('time', None)})
+            return
+        if path == '/_edit':
+            self.workspace.edit_random_pages(payload.get('notion', 0))
+            self.workspace.edit_random_items(payload.get('todoist', 0))
+            self.send_json(204)
+            return
+
+        service = 'notion' if path.startswith('/v1/') else 'todoist'
+        endpoint = f'{method} ' + re.sub(r'/[0-9a-f-]{8,}', '/{id}', path)
+        limiter = self.limiters[service]
+        with self.workspace.lock:
+            self.first_request.setdefault('time', time.time())
+            self.counters[endpoint] = self.counters.get(endpoint, 0) + 1
+        if limiter.latency:
+            time.sleep(limiter.latency)
+        if limiter.should_throttle():
+            with self.workspace.lock:
+                self.counters[f'429 {service}'] = self.counters.get(f'429 {service}', 0) + 1
+            self.send_json(429, {'object': 'error', 'status': 429, 'code': 'rate_limited'}, [('Retry-After', '1')])
+            return
+
+        status, body = self.route(method, path, payload, parse_qs(url.query))
+        self.send_json(status, body)
+
+    def route(self, method, path, payload, query):
+        workspace = self.workspace
+        not_found = (404, {'object': 'error', 'status': 404, 'code': 'object_not_found'})
+        property_ids = set(query.get('filter_properties', []))
+
+        if method == 'GET' and NOTION_DATABASE.match(path):
+            return 200, workspace.render_database()
+        if method == 'POST' and NOTION_QUERY.match(path):
+            return 200, workspace.query_database(payload, property_ids)
+        if method == 'POST' and path == '/v1/pages':
+            return 200, workspace.create_page(payload)
+        match = NOTION_PAGE.match(path)
+        if match and method == 'GET':
+            page = workspace.get_page(match.group(1), property_ids)
+            return (200, page) if page else not_found
+        if match and method == 'PATCH':
+            page = workspace.update_page(match.group(1), payload)
+            return (200, page) if page else not_found
+
+        if path == '/sync/v9/sync' and method == 'POST':
+            return 200, workspace.sync(payload)
+        if path == '/sync/v9/completed/get_all' and method == 'GET':
+            return 200, {'items': workspace.list_completed_tasks()}
+        if path == '/rest/v2/tasks' and method == 'GET':
+            return 200, workspace.list_active_tasks()
+        if path == '/rest/v2/tasks' and method == 'POST':
+            return 200, workspace.create_rest_task(payload)
+        match = TODOIST_TASK.match(path)
+        if match:
+            item_id, action = match.groups()
+            command = {'/close': 'item_close', '/reopen': 'item_uncomplete', None: 'item_update' if method == 'POST' else 'item_delete'}[action]
+            result = workspace.sync({'commands': [{'type': command, 'uuid': str(uuid.uuid4()), 'args': dict(payload, id=item_id)}]})
+            if result['sync_status'] and list(result['sync_status'].values())[0] != 'ok':
+                return 404, {'error': 'Task not found'}
+            return (200, workspace.render_rest_task(item_id)) if command == 'item_update' else (204, None)
+
+        return not_found
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Benchmarks stop the sync while its requests are in flight
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(tasks, notion=None, todoist=None, host='127.0.0.1', port=0):
+    """Create a server for a workspace of ``tasks`` tasks, answering both Notion and Todoist paths."""
+    handler = type('FakeWorkspaceHandler', (FakeApiHandler,), {
+        'workspace': FakeWorkspace(tasks),
+        'limiters': {'notion': notion or ServiceLimiter(), 'todoist': todoist or ServiceLimiter()},
+        'counters': {},
+        'first_request': {},
+    })
+    return FakeServer((host, port), handler)
+
+
+def serve(tasks, notion=None, todoist=None, host='127.0.0.1', port=0, ready=None):
+    """Run a fake server forever, reporting its port through ``ready``."""
+    server = make_server(tasks, notion, todoist, host, port)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run fake Notion and Todoist API servers.')
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='requests per second before answering 429, per service')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429 at random')
+    args = parser.parse_args()
+    limiter = dict(latency=args.latency, rate_limit=args.rate_limit, error_rate=args.error_rate)
+    print(f'Serving {args.tasks} fake tasks on http://127.0.0.1:{args.port}')
+    print(f'  NOTION_API_URL=http://127.0.0.1:{args.port}/v1')
+    print(f'  TODOIST_API_URL=http://127.0.0.1:{args.port}')
+    print(f'  NOTION_DATABASE_ID={DATABASE_ID}')
+    serve(args.tasks, ServiceLimiter(**limiter), ServiceLimiter(**limiter), port=args.port)
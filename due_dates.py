@@ -0,0 +1,63 @@
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Timezone due dates are stored in, and that due dates without one are assumed to be in.
+# Either an offset such as '+08:00' or a name such as 'Asia/Singapore'
+DUE_DATE_TIMEZONE = os.getenv('DUE_DATE_TIMEZONE', '+08:00')
+# Number of distinct due dates whose parsed and normalized forms are remembered
+DUE_DATE_CACHE_SIZE = int(os.getenv('DUE_DATE_CACHE_SIZE', '65536'))
+
+# Function to turn a timezone setting into a tzinfo
+def get_timezone(name):
+    match = re.fullmatch(r'(?:UTC|GMT)?([+-])(\d{1,2}):?(\d{2})?', name.strip())
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return timezone(-offset if sign == '-' else offset)
+    # Only loaded when a zone name is configured
+    import pytz
+    return pytz.timezone(name)
+
+DEFAULT_TIMEZONE = get_timezone(DUE_DATE_TIMEZONE)
+
+# Function to parse a due date from Notion, Todoist or the task file
+# The common ISO 8601 shapes are read by datetime.fromisoformat, anything else by dateutil
+@lru_cache(maxsize=DUE_DATE_CACHE_SIZE)
+def parse_due_date(value):
+    try:
+        # Older Pythons do not read a trailing Z
+        return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        # dateutil takes a while to import and is rarely needed
+        from dateutil.parser import parse
+        return parse(value)
+
+# Function to bring a due date into the stored form, such as '2024-01-31T09:30:00+08:00'
+# Due dates without a timezone are taken to be in the given one, seconds are the smallest unit kept
+def normalize_due_date(value, tz=DEFAULT_TIMEZONE):
+    # None and '' are kept as they are
+    if not value:
+        return value
+    return _normalize_due_date(value, tz)
+
+@lru_cache(maxsize=DUE_DATE_CACHE_SIZE)
+def _normalize_due_date(value, tz):
+    due_date = parse_due_date(value)
+    if due_date.tzinfo is None:
+        due_date = tz.localize(due_date) if hasattr(tz, 'localize') else due_date.replace(tzinfo=tz)
+    return due_date.replace(microsecond=0).astimezone(tz).isoformat()
+
+# Function to format a stored due date for Notion or Todoist
+# All-day tasks, due at midnight, are sent as the date alone such as '2024-01-31'
+@lru_cache(maxsize=DUE_DATE_CACHE_SIZE)
+def format_due_date(value):
+    due_date = parse_due_date(value)
+    if due_date.time() != datetime.min.time():
+        return due_date.isoformat()
+    return due_date.strftime('%Y-%m-%d')
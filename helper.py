@@ -1,10 +1,17 @@
 import requests
+import hashlib
 import json
 import os
 import sys
-import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from dotenv import load_dotenv
+from due_dates import format_due_date, normalize_due_date
+from http_client import *
+import metrics
+from task_store import open_task_store, save_json_atomically
+from task_model import Task, parse_timestamp
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,6 +20,15 @@ load_dotenv()
 NOTION_API_TOKEN = os.getenv('NOTION_API_TOKEN')
 NOTION_DATABASE_ID = os.getenv('NOTION_DATABASE_ID')
 TODOIST_API_TOKEN = os.getenv('TODOIST_API_TOKEN')
+NOTION_API_URL = os.getenv('NOTION_API_URL', 'https://api.notion.com/v1')
+TODOIST_API_URL = os.getenv('TODOIST_API_URL', 'https://api.todoist.com')
+# Seconds between full Notion scans; cycles in between only fetch edited rows
+NOTION_FULL_SCAN_INTERVAL = int(os.getenv('NOTION_FULL_SCAN_INTERVAL', '3600'))
+
+# Maximum number of results Notion returns per database query
+NOTION_PAGE_SIZE = 100
+# Maximum number of commands Todoist accepts in a single Sync API request
+TODOIST_COMMAND_BATCH_SIZE = 100
 
 notion_headers = {
     'Authorization': f'Bearer {NOTION_API_TOKEN}',
@@ -25,28 +41,233 @@ todoist_headers = {
     'Content-Type': 'application/json'
 }
 
+# Function to point the sync at another Notion database and Todoist account,
+# used by supervisor workers that sync several workspaces in one process
+def configure_workspace(notion_api_token, notion_database_id, todoist_api_token):
+    global NOTION_API_TOKEN, NOTION_DATABASE_ID, TODOIST_API_TOKEN
+    NOTION_API_TOKEN, NOTION_DATABASE_ID, TODOIST_API_TOKEN = notion_api_token, notion_database_id, todoist_api_token
+    # Updated in place, the other scripts hold references to these dicts
+    notion_headers['Authorization'] = f'Bearer {notion_api_token}'
+    todoist_headers['Authorization'] = f'Bearer {todoist_api_token}'
+
 # Function to clear the console
 def cls():
     os.system('cls' if os.name == 'nt' else 'clear')
 
-# Function to get tasks from Notion
-def get_notion_tasks():
-    url = f'https://api.notion.com/v1/databases/{NOTION_DATABASE_ID}/query'
-    response = requests.post(url, headers=notion_headers)
+# Properties of the Notion database that the sync reads
+NOTION_TASK_PROPERTIES = ('Name', 'Done', 'Date', 'Type', 'ID')
+# IDs of the database properties by name, keyed by database ID, None if the schema could not be read
+notion_property_ids = {}
+
+# Function to query one page of results from the Notion database
+def query_notion_database(payload, query_string=''):
+    url = f'{NOTION_API_URL}/databases/{NOTION_DATABASE_ID}/query{query_string}'
+    # Queries only read, so they are retried like a GET
+    response = notion_session.post(url, headers=notion_headers, data=json.dumps(payload), idempotent=True)
     if response.status_code == 401:
         print("Error: Invalid Notion API token. Please check your NOTION_API_TOKEN environment variable.")
         sys.exit(1)
     if response.status_code == 400:
         print("Error: Invalid Notion Database ID. Please check your NOTION_DATABASE_ID environment variable.")
         sys.exit(2)
-    
+
+    response.raise_for_status()
+    return response.json()
+
+# Function to build the query string that makes Notion return only the named properties
+# Every property is returned if the database schema cannot be read
+def get_filter_properties_query(names):
+    if NOTION_DATABASE_ID not in notion_property_ids:
+        url = f'{NOTION_API_URL}/databases/{NOTION_DATABASE_ID}'
+        response = notion_session.get(url, headers=notion_headers)
+        property_ids = {name: prop['id'] for name, prop in response.json()['properties'].items()} if response.ok else None
+        if response.status_code == 429 or response.status_code >= 500:
+            # Asked again next time instead of fetching every property from now on
+            return ''
+        notion_property_ids[NOTION_DATABASE_ID] = property_ids
+    property_ids = notion_property_ids[NOTION_DATABASE_ID]
+    if not property_ids:
+        return ''
+    # Notion hands out property IDs already URL-encoded
+    return '?' + '&'.join(f'filter_properties={property_ids[name]}' for name in names if name in property_ids)
+
+# Function to reduce a Notion page to the fields the sync reads, so the nested page objects can be freed
+def project_notion_page(page):
+    properties = page.get('properties', {})
+    title = properties.get('Name', {}).get('title') or [{}]
+    date = properties.get('Date', {}).get('date')
+    return {
+        'id': page['id'],
+        'last_edited_time': page.get('last_edited_time'),
+        'archived': bool(page.get('archived') or page.get('in_trash')),
+        'database_id': (page.get('parent') or {}).get('database_id'),
+        'name': title[0].get('text', {}).get('content', ''),
+        'completed': properties.get('Done', {}).get('checkbox', False),
+        'due_date': date['start'] if date else None,
+        'labels': [option['name'] for option in properties.get('Type', {}).get('multi_select', [])],
+        'todoist_id': properties.get('ID', {}).get('number')
+    }
+
+# Function to stream the raw pages of the Notion database, following the pagination cursor
+# Pass the names of the properties to fetch, or None for all of them
+def iter_notion_pages(query=None, properties=None, transform=None):
+    payload = dict(query or {}, page_size=NOTION_PAGE_SIZE)
+    query_string = get_filter_properties_query(properties) if properties else ''
+
+    def fetch(payload):
+        data = query_notion_database(payload, query_string)
+        if transform:
+            # Done in the fetching thread, so only the transformed results are kept
+            data['results'] = [transform(page) for page in data.get('results') or []]
+        return data
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch, payload)
+        while future is not None:
+            data = future.result()
+            next_cursor = data.get('next_cursor') if data.get('has_more') else None
+            # Request the next page while the caller works through this one
+            future = executor.submit(fetch, dict(payload, start_cursor=next_cursor)) if next_cursor else None
+            yield from data.get('results') or []
+
+# Function to stream tasks from Notion as compact projections of their pages
+def iter_notion_tasks(query=None, properties=NOTION_TASK_PROPERTIES):
+    return iter_notion_pages(query, properties, project_notion_page)
+
+# Function to get a single task from Notion, returns None if its page no longer exists
+def get_notion_page(page_id):
+    url = f'{NOTION_API_URL}/pages/{page_id}{get_filter_properties_query(NOTION_TASK_PROPERTIES)}'
+    response = notion_session.get(url, headers=notion_headers)
+    if response.status_code == 404:
+        return None
     response.raise_for_status()
-    return response.json().get('results')
+    return project_notion_page(response.json())
+
+# Notion property changes waiting to be sent, by page ID, as [properties, callbacks]
+notion_write_buffer = {}
+# Properties of Notion pages read since the last flush, in the format they are written in
+notion_known_properties = {}
+notion_write_lock = threading.Lock()
+
+# Function to remember the properties of a Notion task as read, so writing the same values is skipped
+def remember_notion_page(task):
+    notion_known_properties[task['id']] = {
+        'Name': {'title': [{'text': {'content': task['name']}}]},
+        'Done': {'checkbox': task['completed']},
+        'Type': {'multi_select': [{'name': label} for label in task['labels']]},
+        # In the form Sync writes dates in, so an unchanged date compares equal
+        'Date': {'date': {'start': format_due_date(normalize_due_date(task['due_date']))} if task['due_date'] else None},
+        'ID': {'number': task['todoist_id']}
+    }
+
+# Function to queue a change to the properties of a Notion page, changes to the same page are
+# sent as one PATCH by flush_notion_updates. on_sent is called once the page holds the new values
+# Returns False if the page already had these values and nothing has to be sent
+def queue_notion_update(page_id, properties, on_sent=None):
+    with notion_write_lock:
+        known = notion_known_properties.get(page_id, {})
+        entry = notion_write_buffer.get(page_id)
+        # A value matching the page is still sent if it replaces a different queued value
+        changes = {name: value for name, value in properties.items() if known.get(name) != value or (entry and name in entry[0])}
+        if changes or entry:
+            entry = notion_write_buffer.setdefault(page_id, [{}, []])
+            entry[0].update(changes)
+            if on_sent:
+                entry[1].append(on_sent)
+            return True
+    if on_sent:
+        on_sent()
+    return False
+
+# Function to send the queued changes of one Notion page
+def send_notion_update(update):
+    page_id, (properties, callbacks) = update
+    url = f'{NOTION_API_URL}/pages/{page_id}'
+    try:
+        response = notion_session.patch(url, headers=notion_headers, data=json.dumps({'properties': properties}))
+        response.raise_for_status()
+    except Exception as e:
+        # Keep the changes for the next flush unless the page is gone, newer changes win
+        if not isinstance(e, requests.exceptions.HTTPError) or e.response.status_code not in (400, 404):
+            with notion_write_lock:
+                entry = notion_write_buffer.setdefault(page_id, [{}, []])
+                entry[0] = dict(properties, **entry[0])
+                entry[1][:0] = callbacks
+        raise
+    for callback in callbacks:
+        callback()
+
+# Function to send one combined PATCH for every Notion page with queued changes
+def flush_notion_updates():
+    with notion_write_lock:
+        updates = list(notion_write_buffer.items())
+        notion_write_buffer.clear()
+        notion_known_properties.clear()
+    run_concurrently(notion_session, send_notion_update, updates)
+
+# Function to check whether a Notion task belongs to the synced database
+def is_in_notion_database(task):
+    database_id = task['database_id'] or ''
+    return database_id.replace('-', '') == NOTION_DATABASE_ID.replace('-', '')
+
+# Function to get tasks from Notion
+def get_notion_tasks():
+    return list(iter_notion_tasks())
+
+# Remote collections fetched in the current cycle, by name
+cycle_snapshots = {}
+# Snapshot lookups answered from memory (hits) or by fetching (misses), this cycle and in total
+snapshot_stats = {'hits': 0, 'misses': 0, 'cycle_hits': 0, 'cycle_misses': 0}
+
+# Function to start a new cycle, remote collections are fetched again when next needed
+# The snapshots named in keep are carried over, for callers that keep them up to date themselves
+def begin_cycle(keep=()):
+    if snapshot_stats['cycle_hits']:
+        print(f"Snapshot cache: {snapshot_stats['cycle_hits']} fetches saved, {snapshot_stats['cycle_misses']} made last cycle")
+    snapshot_stats['cycle_hits'] = snapshot_stats['cycle_misses'] = 0
+    kept = {name: cycle_snapshots[name] for name in keep if name in cycle_snapshots}
+    cycle_snapshots.clear()
+    cycle_snapshots.update(kept)
+
+# Function to get a remote collection, fetching it only once per cycle
+def get_snapshot(name, fetch):
+    if name in cycle_snapshots:
+        snapshot_stats['hits'] += 1
+        snapshot_stats['cycle_hits'] += 1
+        return cycle_snapshots[name]
+    snapshot_stats['misses'] += 1
+    snapshot_stats['cycle_misses'] += 1
+    cycle_snapshots[name] = fetch()
+    return cycle_snapshots[name]
+
+# Function to get a remote collection if it was fetched this cycle, without fetching it
+def peek_snapshot(name, default=None):
+    return cycle_snapshots.get(name, default)
+
+# Function to store a remote collection that was read as a side effect of other work
+def set_snapshot(name, value):
+    cycle_snapshots[name] = value
+
+# Function to drop snapshots that a local write has made out of date
+def invalidate_snapshots(*names):
+    for name in names:
+        cycle_snapshots.pop(name, None)
+
+# Function to get the Todoist IDs stored in the ID column of the Notion database
+def get_notion_todoist_ids():
+    return get_snapshot('notion-todoist-ids', lambda: {
+        todoist_id for todoist_id in iter_notion_pages(properties=('ID',), transform=lambda page: project_notion_page(page)['todoist_id'])
+        if todoist_id is not None
+    })
 
 # Function to get tasks from Todoist
 def get_todoist_tasks():
-    url = 'https://api.todoist.com/rest/v2/tasks'
-    response = requests.get(url, headers=todoist_headers)
+    return get_snapshot('todoist-tasks', fetch_todoist_tasks)
+
+# Function to fetch the active tasks from the Todoist REST API
+def fetch_todoist_tasks():
+    url = f'{TODOIST_API_URL}/rest/v2/tasks'
+    response = todoist_session.get(url, headers=todoist_headers)
     if response.status_code == 401:
         print("Error: Invalid Todoist API token. Please check your TODOIST_API_TOKEN environment variable.")
         sys.exit(3)
@@ -55,45 +276,153 @@ def get_todoist_tasks():
 
 # Function to get completed tasks from Todoist
 def get_completed_todoist_tasks():
-    url = 'https://api.todoist.com/sync/v9/completed/get_all'
-    response = requests.get(url, headers=todoist_headers)
+    return get_snapshot('todoist-completed', fetch_completed_todoist_tasks)
+
+# Function to fetch the completed tasks from the Todoist Sync API
+def fetch_completed_todoist_tasks():
+    url = f'{TODOIST_API_URL}/sync/v9/completed/get_all'
+    response = todoist_session.get(url, headers=todoist_headers)
     if response.status_code == 401:
         print("Error: Invalid Todoist API token. Please check your TODOIST_API_TOKEN environment variable.")
         sys.exit(3)
     response.raise_for_status()
     return response.json().get('items', [])
 
-# Function to save tasks to the JSON file
+# Function to get items changed since the given sync token from the Todoist Sync API
+def sync_todoist_items(sync_token='*'):
+    url = f'{TODOIST_API_URL}/sync/v9/sync'
+    payload = {
+        'sync_token': sync_token,
+        'resource_types': ['items']
+    }
+    # Reading with a sync token changes nothing, so it is retried like a GET
+    response = todoist_session.post(url, headers=todoist_headers, data=json.dumps(payload), idempotent=True)
+    if response.status_code == 401:
+        print("Error: Invalid Todoist API token. Please check your TODOIST_API_TOKEN environment variable.")
+        sys.exit(3)
+    if response.status_code == 400 and sync_token != '*':
+        print("Todoist rejected the stored sync token, falling back to a full sync...")
+        return sync_todoist_items('*')
+    response.raise_for_status()
+    return response.json()
+
+# Function to send a batch of write commands to the Todoist Sync API
+def post_todoist_commands(commands):
+    url = f'{TODOIST_API_URL}/sync/v9/sync'
+    # The commands change the Todoist task lists
+    invalidate_snapshots('todoist-tasks', 'todoist-completed')
+    # Todoist skips commands whose uuid it has already applied, so the batch can be sent again
+    response = todoist_session.post(url, headers=todoist_headers, data=json.dumps({'commands': commands}), idempotent=True)
+    if response.status_code == 401:
+        print("Error: Invalid Todoist API token. Please check your TODOIST_API_TOKEN environment variable.")
+        sys.exit(3)
+    response.raise_for_status()
+    return response.json()
+
+# Function to fingerprint the synced fields of a task as read from one side
+def get_task_fingerprint(name, completed, due_date, labels):
+    canonical = json.dumps([name, bool(completed), due_date, sorted(labels)], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+# Tasks kept in memory between cycles, keyed by the absolute path of their file
+tasks_cache = {}
+# Tasks changed since they were last saved, by Notion ID, keyed by the absolute path of their file
+dirty_tasks = {}
+# Open task stores, keyed by the absolute path of their file
+task_stores = {}
+
+# Function to record that a task has changed and has to be saved and synced
+def mark_task_dirty(task, filename='tasks.json'):
+    dirty_tasks.setdefault(os.path.abspath(filename), {})[task.notion_id] = task
+
+# Function to record a change that came from one side, 'notion' or 'todoist', and when it happened
+# The side it came from is already up to date, only the other side has to be synced
+def mark_task_changed(task, source, filename='tasks.json'):
+    task.touch()
+    task.version = (task.version or 0) + 1
+    task.changed_by = source
+    task.set_side_version(source, task.version)
+    mark_task_dirty(task, filename)
+
+# Function to check whether one side of a task is behind the local copy
+def is_task_stale(task, side):
+    # Tasks saved before versions were tracked are synced to both sides
+    if task.version is None:
+        return True
+    return task.get_side_version(side) < task.version
+
+# Function to record that one side of a task is up to date
+def mark_task_synced(task, side, version, filename='tasks.json'):
+    if task.version is None:
+        task.version = version
+    task.set_side_version(side, version)
+    # The fingerprint of that side is out of date now, so an edit back to the values it
+    # was taken from is not skipped. The echo of this write is compared field by field
+    if side == 'notion':
+        task.notion_hash = None
+    else:
+        task.todoist_hash = None
+    mark_task_dirty(task, filename)
+
+# Function to get the store that keeps the tasks of the given file
+def get_task_store(filename):
+    path = os.path.abspath(filename)
+    if path not in task_stores:
+        task_stores[path] = open_task_store(filename)
+    return task_stores[path]
+
+# Function to drop the tasks and stores kept in memory for the files in a folder
+def forget_files(directory):
+    directory = os.path.join(os.path.abspath(directory), '')
+    for cache in (tasks_cache, dirty_tasks, task_stores):
+        for path in [path for path in cache if path.startswith(directory)]:
+            cache.pop(path)
+
+# Function to write the changed and removed tasks to the store, returns True if there were any
+def write_tasks_to_json(tasks, filename, removed_ids=()):
+    path = os.path.abspath(filename)
+    tasks_cache[path] = tasks
+    changed_tasks = list(dirty_tasks.pop(path, {}).values())
+    if not changed_tasks and not removed_ids:
+        return False
+
+    with metrics.span('persist'):
+        get_task_store(filename).save(tasks, changed_tasks, removed_ids)
+    return True
+
+# The caches are copied first, as the sync thread may change them while metrics are served
+metrics.register_gauge('sync_tasks', 'Tasks kept in memory, by file.', lambda: {(('file', os.path.basename(path)),): len(tasks) for path, tasks in list(tasks_cache.items())})
+metrics.register_gauge('sync_dirty_tasks', 'Tasks changed since they were last saved, by file.', lambda: {(('file', os.path.basename(path)),): len(tasks) for path, tasks in list(dirty_tasks.items())})
+metrics.register_gauge('sync_pending_notion_updates', 'Notion pages with queued property changes.', lambda: len(notion_write_buffer))
+metrics.register_gauge('sync_snapshot_lookups', 'Remote collections answered from the cycle snapshot (hit) or fetched (miss).', lambda: {(('result', 'hit'),): snapshot_stats['hits'], (('result', 'miss'),): snapshot_stats['misses']})
+
+# Function to save tasks to the JSON file, returns True if they changed
 def save_tasks_to_json(tasks, filename, name):
-    try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            existing_tasks = json.load(file)
-    except FileNotFoundError:
-        existing_tasks = []
-
-    if tasks != existing_tasks:
-        with open(filename, 'w', encoding='utf-8') as file:
-            json.dump(tasks, file, ensure_ascii=False, indent=2, default=str)
+    changed_tasks = list(dirty_tasks.get(os.path.abspath(filename), {}).values())
+    if write_tasks_to_json(tasks, filename):
         print(f"Update from " + name + ", tasks saved to " + filename + ".")
-        # Run Sync.py after saving the JSON data
-        result = subprocess.run(["python", "Sync.py"], capture_output=True, text=True)
-        if result.returncode == 0:
+        # Run Sync.py in this process for the tasks that changed
+        from Sync import sync_local_tasks_to_notion_and_todoist
+        try:
+            sync_local_tasks_to_notion_and_todoist(changed_tasks)
             print("Sync.py executed successfully.")
-        else:
-            print(f"Sync.py execution failed with error: {result.stderr}")
+        except Exception as e:
+            print(f"Sync.py execution failed with error: {e}")
+            # Keep the tasks dirty so the next cycle syncs them again
+            for task in changed_tasks:
+                mark_task_dirty(task, filename)
+        return True
     else:
         print(f"No changes detected from " + name)
+        return False
 
 
-# Function to load tasks from the JSON file
+# Function to load tasks from the JSON file, reusing the copy kept in memory
 def load_tasks_from_json(filename):
-    try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            tasks = json.load(file)
-    except FileNotFoundError:
-        tasks = []
-    # Ensure all tasks have the 'deleted' field
-    for task in tasks:
-        if 'deleted' not in task:
-            task['deleted'] = False
-    return tasks
\ No newline at end of file
+    path = os.path.abspath(filename)
+    if path in tasks_cache:
+        return tasks_cache[path]
+
+    tasks = get_task_store(filename).load()
+    tasks_cache[path] = tasks
+    return tasks
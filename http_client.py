@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from rate_limiter import TokenBucket, get_retry_delay
+import metrics
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Maximum number of requests in flight at once for each service
+NOTION_MAX_CONCURRENCY = int(os.getenv('NOTION_MAX_CONCURRENCY', '3'))
+TODOIST_MAX_CONCURRENCY = int(os.getenv('TODOIST_MAX_CONCURRENCY', '4'))
+
+# Sustained requests per second and burst size allowed for each service
+NOTION_RATE_LIMIT = float(os.getenv('NOTION_RATE_LIMIT', '3'))
+NOTION_RATE_BURST = int(os.getenv('NOTION_RATE_BURST', '10'))
+TODOIST_RATE_LIMIT = float(os.getenv('TODOIST_RATE_LIMIT', '0.5'))
+TODOIST_RATE_BURST = int(os.getenv('TODOIST_RATE_BURST', '50'))
+
+# Responses that are retried, and how many times before giving up
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Methods that are safe to send again after a server error, as the server may have applied the first one
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'}
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '5'))
+
+# Session that keeps connections alive, caps the number of concurrent requests
+# and keeps within the service's rate limit, retrying throttled requests
+class ServiceSession(requests.Session):
+    def __init__(self, service, max_concurrency, rate_limit, rate_burst):
+        super().__init__()
+        self.service = service
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = TokenBucket(rate_limit, rate_burst)
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'server_errors': 0, 'throttled_seconds': 0.0}
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    # Pass idempotent=True for a POST that can be repeated safely, such as a read-only query
+    # or one the server deduplicates. Other POSTs are only retried after a 429
+    def request(self, method, url, *args, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        endpoint = metrics.get_endpoint(method, url)
+        labels = (('service', self.service), ('endpoint', endpoint))
+        while True:
+            self.count('throttled_seconds', self.bucket.acquire())
+            with self.slots:
+                start = time.perf_counter()
+                try:
+                    response = super().request(method, url, *args, **kwargs)
+                except requests.exceptions.RequestException:
+                    metrics.increment('http_errors_total', labels)
+                    raise
+                metrics.observe('http_request_seconds', time.perf_counter() - start, labels)
+            self.count('requests')
+            metrics.increment('http_requests_total', labels + (('status', response.status_code),))
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= MAX_RETRIES:
+                return response
+            if response.status_code != 429 and not idempotent:
+                return response
+
+            delay = get_retry_delay(attempt, response.headers.get('Retry-After'))
+            metrics.increment('http_retries_total', labels)
+            if response.status_code == 429:
+                # Hold back every worker for this service, not just this one
+                self.count('rate_limited')
+                metrics.increment('http_rate_limited_total', (('service', self.service),))
+                self.bucket.pause(delay)
+            else:
+                self.count('server_errors')
+                self.count('throttled_seconds', delay)
+                time.sleep(delay)
+            print(f"{self.service.capitalize()} returned {response.status_code}, retrying in {delay:.1f}s...")
+            response.close()
+            self.count('retries')
+            attempt += 1
+
+notion_session = ServiceSession('notion', NOTION_MAX_CONCURRENCY, NOTION_RATE_LIMIT, NOTION_RATE_BURST)
+todoist_session = ServiceSession('todoist', TODOIST_MAX_CONCURRENCY, TODOIST_RATE_LIMIT, TODOIST_RATE_BURST)
+
+# Function to create the rate-limit buckets of one account, one for each service
+def create_rate_buckets():
+    return {
+        'notion': TokenBucket(NOTION_RATE_LIMIT, NOTION_RATE_BURST),
+        'todoist': TokenBucket(TODOIST_RATE_LIMIT, TODOIST_RATE_BURST)
+    }
+
+# Function to make the sessions keep within another account's rate limits
+def use_rate_buckets(buckets):
+    notion_session.bucket = buckets['notion']
+    todoist_session.bucket = buckets['todoist']
+
+# Function to get request and throttling counters for each service
+def get_throttle_stats():
+    stats = {}
+    for session in (notion_session, todoist_session):
+        with session.stats_lock:
+            stats[session.service] = dict(session.stats)
+    return stats
+
+metrics.register_gauge('http_throttled_seconds', 'Seconds spent waiting for the rate limit or a Retry-After, by service.', lambda: {(('service', service),): stats['throttled_seconds'] for service, stats in get_throttle_stats().items()})
+
+# Function to call function(item) for every item using the session's worker limit
+def run_concurrently(session, function, items):
+    items = list(items)
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=session.max_concurrency) as executor:
+        return list(executor.map(function, items))
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+
+# Number of finished entries after which the journal file is rewritten without them
+JOURNAL_COMPACT_AFTER = 1000
+
+# Append-only log of remote changes. Each change is written as pending before it is
+# sent and as done once it has been answered, so after a crash the changes that may
+# not have reached Notion or Todoist can be replayed with the same idempotency key
+class MutationJournal:
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.finished = 0
+        self.load()
+        self.file = open(filename, 'a', encoding='utf-8')
+
+    def load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be cut short by a crash
+                        continue
+                    if entry['state'] == 'pending':
+                        self.pending[entry['key']] = entry
+                    elif self.pending.pop(entry['key'], None) is not None:
+                        self.finished += 1
+        except FileNotFoundError:
+            pass
+
+    def append(self, entries, durable):
+        with self.lock:
+            self.file.write(''.join(json.dumps(entry, ensure_ascii=False, default=str) + '\n' for entry in entries))
+            self.file.flush()
+            if durable:
+                os.fsync(self.file.fileno())
+
+    # Record changes that are about to be sent, each entry needs a unique 'key'
+    def begin(self, entries):
+        for entry in entries:
+            entry['state'] = 'pending'
+            self.pending[entry['key']] = entry
+        # Must be on disk before the request goes out
+        self.append(entries, durable=True)
+
+    # Record that changes were answered, successfully or not
+    def finish(self, keys):
+        entries = [{'key': key, 'state': 'done'} for key in keys if self.pending.pop(key, None) is not None]
+        self.finished += len(entries)
+        # Losing a done entry only means a harmless replay, so it is not synced to disk
+        self.append(entries, durable=False)
+
+    def get_pending(self):
+        return list(self.pending.values())
+
+    # Rewrite the journal with only its pending entries once enough have finished
+    def compact(self):
+        if self.finished < JOURNAL_COMPACT_AFTER:
+            return
+        with self.lock:
+            with open(self.filename + '.tmp', 'w', encoding='utf-8') as file:
+                file.write(''.join(json.dumps(entry, ensure_ascii=False, default=str) + '\n' for entry in self.pending.values()))
+                file.flush()
+                os.fsync(file.fileno())
+            self.file.close()
+            os.replace(self.filename + '.tmp', self.filename)
+            self.file = open(self.filename, 'a', encoding='utf-8')
+            self.finished = 0
+
+# Function to close the journals kept in a folder
+def close_journals(directory):
+    directory = os.path.join(os.path.abspath(directory), '')
+    for path in [path for path in journals if path.startswith(directory)]:
+        journals.pop(path).file.close()
+
+# Open journals, keyed by the absolute path of their file
+journals = {}
+
+# Function to get the journal kept in the given file
+def get_journal(filename='sync_journal.jsonl'):
+    path = os.path.abspath(filename)
+    if path not in journals:
+        journals[path] = MutationJournal(path)
+    return journals[path]
@@ -1,45 +1,152 @@
-import subprocess
+import argparse
+import os
+import sys
 import time
 
-def run_script(script_name):
-    """Run a Python script and print its output in real-time."""
+# The sync modules are imported by the functions that use them, so a one-shot run
+# only loads what its phases need and importing this module has no side effects
+
+def run_phase(phase_name, phase, failures=None):
+    """Run one sync phase in this process. Returns True if it changed any tasks.
+
+    If it fails, its name is added to ``failures`` when given."""
+    import metrics
+
+    print(f"Running {phase_name}...")
     try:
-        process = subprocess.Popen(["python", script_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                print(output.strip())
-        return process.poll()
-    except subprocess.CalledProcessError as e:
-        if e.returncode == 1:
-            print("Error: Invalid Notion API token. Please check your NOTION_API_TOKEN environment variable.")
-        elif e.returncode == 2:
-            print("Error: Invalid Notion Database ID. Please check your NOTION_DATABASE_ID environment variable.")
-        elif e.returncode == 3:
-            print("Error: Invalid Todoist API token. Please check your TODOIST_API_TOKEN environment variable.")
-        return None
-
-def main():
+        with metrics.phase_span(phase_name), metrics.profile(phase_name):
+            return phase()
+    except Exception as e:
+        # Invalid credentials exit the process; anything else is retried next cycle
+        print(f"{phase_name} failed with error: {e}")
+        if failures is not None:
+            failures.append(phase_name)
+        return False
+
+def run_webhook_loop():
+    """Sync the tasks named by webhook events, with a slow full reconciliation as a safety net."""
+    from Notion_to_Local import sync_notion_to_json
+    from Todoist_to_Local import sync_todoist_to_json
+    from helper import begin_cycle
+    from webhook_server import RECONCILE_INTERVAL, WEBHOOK_PORT, ChangeQueue, start_webhook_server
+
+    change_queue = ChangeQueue()
+    start_webhook_server(change_queue)
+    print(f"Listening for webhook events on port {WEBHOOK_PORT}...")
+
+    next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+    while True:
+        changes = change_queue.wait(max(0.0, next_reconcile - time.monotonic()))
+        if time.monotonic() >= next_reconcile:
+            begin_cycle()
+            # Reconcile in case an event was missed, even while events keep arriving.
+            # The full pass also picks up the changes that were just received
+            run_phase("Notion_to_Local", sync_notion_to_json)
+            run_phase("Todoist_to_Local", sync_todoist_to_json)
+            next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+            continue
+
+        # The Notion ID column is kept between event batches, so a burst of Todoist events
+        # reads it at most once. Pages created or read in between add their IDs to it
+        begin_cycle(keep=('notion-todoist-ids',))
+        if 'notion' in changes:
+            page_ids = sorted(changes['notion'])
+            run_phase("Notion_to_Local", lambda: sync_notion_to_json(page_ids))
+        if 'todoist' in changes:
+            # The Todoist sync token already limits the fetch to changed items
+            run_phase("Todoist_to_Local", sync_todoist_to_json)
+
+def run_notion_cycle():
+    """Start a new cycle with the Notion phase, the Todoist polls until the next one share its snapshots."""
+    from Notion_to_Local import sync_notion_to_json
+    from helper import begin_cycle
+
+    begin_cycle()
+    return run_phase("Notion_to_Local", sync_notion_to_json)
+
+def run_polling_loop():
+    """Poll Notion and Todoist on independent intervals that adapt to how often they change."""
+    from Todoist_to_Local import sync_todoist_to_json
+    from scheduler import AdaptiveInterval, poll_forever
+
+    poll_forever([
+        (AdaptiveInterval("Notion"), run_notion_cycle),
+        (AdaptiveInterval("Todoist"), lambda: run_phase("Todoist_to_Local", sync_todoist_to_json)),
+    ])
+
+def run_forever():
+    """Sync until stopped, with the workspace pool, webhooks or polling, whichever is configured."""
+    from supervisor import WORKSPACES_FILE, run_supervisor
+    from webhook_server import ENABLE_WEBHOOKS, WEBHOOK_PORT
+    import metrics
+
+    if os.path.exists(WORKSPACES_FILE):
+        # Several workspaces are synced by a pool of worker processes
+        run_supervisor()
+    elif ENABLE_WEBHOOKS:
+        # The webhook receiver also serves /metrics
+        run_webhook_loop()
+    else:
+        if metrics.ENABLE_METRICS:
+            metrics.start_metrics_server(WEBHOOK_PORT)
+            print(f"Serving metrics on port {WEBHOOK_PORT}...")
+        run_polling_loop()
+
+def get_notion_phase():
+    from Notion_to_Local import sync_notion_to_json
+    return sync_notion_to_json
+
+def get_todoist_phase():
+    from Todoist_to_Local import sync_todoist_to_json
+    return sync_todoist_to_json
+
+def get_push_phase():
+    from Sync import sync_local_tasks_to_notion_and_todoist
+    return sync_local_tasks_to_notion_and_todoist
+
+# Phases that can be run on their own, by command name
+PHASES = {
+    'notion': ("Notion_to_Local", get_notion_phase),
+    'todoist': ("Todoist_to_Local", get_todoist_phase),
+    'push': ("Sync", get_push_phase),
+}
+
+def run_once(commands):
+    """Run the named phases once each, for cron jobs and short-lived containers. Returns the exit status."""
+    failures = []
+    for command in commands:
+        phase_name, get_phase = PHASES[command]
+        if command == 'notion':
+            # A new cycle, so the Todoist phase after it can reuse its snapshots
+            from helper import begin_cycle
+            begin_cycle()
+        run_phase(phase_name, get_phase(), failures)
+    if failures:
+        print(f"Failed phases: {', '.join(failures)}")
+        return 1
+    return 0
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Sync a Notion database with Todoist.")
+    parser.add_argument('--once', action='store_true', help="run one Notion and one Todoist phase, then exit")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.add_parser('run', help="keep syncing until stopped (the default)")
+    subparsers.add_parser('notion', help="read changes from Notion once and push them to Todoist")
+    subparsers.add_parser('todoist', help="read changes from Todoist once and push them to Notion")
+    subparsers.add_parser('push', help="push every local task that is out of date on either side")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
     try:
-        while True:
-            # Run Notion_to_Local.py
-            print("Running Notion_to_Local.py...")
-            result = run_script("Notion_to_Local.py")
-            if result is None:
-                break
-            time.sleep(4)
-            
-            # Run Todoist_to_Local.py
-            print("Running Todoist_to_Local.py...")
-            result = run_script("Todoist_to_Local.py")
-            if result is None:
-                break
-            time.sleep(4)
-            
+        if args.command in PHASES:
+            return run_once([args.command])
+        if args.once:
+            return run_once(['notion', 'todoist'])
+        run_forever()
     except KeyboardInterrupt:
         print("Exiting gracefully...")
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import bisect
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration
+ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'false').lower() in ('1', 'true', 'yes')
+# Folder to write a cProfile dump of every phase to, profiling is off when unset
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+# Upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+DESCRIPTIONS = {
+    'sync_span_seconds': ('histogram', 'Time spent in each step of a sync phase.'),
+    'http_requests_total': ('counter', 'HTTP requests sent, by service, endpoint and status.'),
+    'http_request_seconds': ('histogram', 'HTTP request latency, by service and endpoint.'),
+    'http_retries_total': ('counter', 'HTTP requests retried after a 429 or 5xx response.'),
+    'http_rate_limited_total': ('counter', 'HTTP responses with status 429.'),
+    'http_errors_total': ('counter', 'HTTP requests that failed without a response.'),
+}
+
+lock = threading.Lock()
+# Values by (name, labels), labels being a tuple of (label, value) pairs
+counters = {}
+# [count per bucket, sum, count] by (name, labels)
+histograms = {}
+# Functions returning the current value of a gauge, or a {labels: value} dict, by name
+gauges = {}
+# Phase that spans are recorded for, set by phase_span
+current_phase = 'sync'
+
+# Function to add to a counter
+def increment(name, labels=(), amount=1):
+    with lock:
+        counters[(name, labels)] = counters.get((name, labels), 0) + amount
+
+# Function to record a value, such as a duration in seconds, in a histogram
+def observe(name, value, labels=()):
+    with lock:
+        histogram = histograms.get((name, labels))
+        if histogram is None:
+            histogram = histograms[(name, labels)] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+# Function to register a gauge that is read whenever the metrics are requested
+def register_gauge(name, description, function):
+    DESCRIPTIONS[name] = ('gauge', description)
+    gauges[name] = function
+
+# Function to record the duration of one step of the current phase
+def observe_span(step, seconds):
+    observe('sync_span_seconds', seconds, (('phase', current_phase), ('step', step)))
+
+# Time a step of the current phase, such as 'fetch', 'diff', 'persist' or 'push'
+@contextmanager
+def span(step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_span(step, time.perf_counter() - start)
+
+# Time a whole phase, steps recorded inside it are labelled with its name
+@contextmanager
+def phase_span(phase):
+    global current_phase
+    previous, current_phase = current_phase, phase
+    try:
+        with span('total'):
+            yield
+    finally:
+        current_phase = previous
+
+# Iterates over lazily fetched items, adding up the time spent waiting for them,
+# so the time spent on each item can be told apart from the time spent fetching
+class FetchTimer:
+    def __init__(self, items):
+        self.items = items
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        iterator = iter(self.items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.elapsed += time.perf_counter() - start
+            yield item
+
+# Function to turn a request URL into an endpoint label without IDs, such as 'PATCH /v1/pages/{id}'
+def get_endpoint(method, url):
+    path = re.sub(r'^[a-z]+://[^/]+', '', url).split('?')[0]
+    return f"{method.upper()} {re.sub(r'/(?=[0-9a-f-]*[0-9])[0-9a-f-]{6,}(?=/|$)', '/{id}', path)}"
+
+# Function to write a label set in the text format
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+# Function to render every metric in the Prometheus text format
+def render():
+    lines = []
+    described = set()
+
+    def describe(name):
+        if name not in described and name in DESCRIPTIONS:
+            described.add(name)
+            metric_type, description = DESCRIPTIONS[name]
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+    with lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in histograms.items())
+
+    for (name, labels), value in counter_items:
+        describe(name)
+        lines.append(f'{name}{format_labels(labels)} {value}')
+
+    for (name, labels), (buckets, total, count) in histogram_items:
+        describe(name)
+        cumulative = 0
+        for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+            cumulative += bucket
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {total}')
+        lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+    for name, function in sorted(gauges.items()):
+        describe(name)
+        value = function()
+        for labels, value in (value.items() if isinstance(value, dict) else [((), value)]):
+            lines.append(f'{name}{format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+# Function to answer a request with the rendered metrics
+def send_metrics(handler):
+    data = render().encode('utf-8')
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+    handler.send_header('Content-Length', str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+# Function to serve /metrics in a background thread, used when the webhook receiver is not running
+def start_metrics_server(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                send_metrics(self)
+            else:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Profile the code inside when PROFILE_DIR is set, writing one dump per run
+@contextmanager
+def profile(name):
+    if not PROFILE_DIR:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = os.path.join(PROFILE_DIR, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.prof")
+        profiler.dump_stats(filename)
+        print(f"Profile of {name} written to {filename}")
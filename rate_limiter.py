@@ -0,0 +1,44 @@
+import random
+import threading
+import time
+
+# Token bucket that lets `rate` requests per second through, with bursts of up to `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    # Wait until a request may be sent, returns the number of seconds spent waiting
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    # Hold back every request for the given number of seconds, e.g. after a 429
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+# Function to get the delay before retrying a request, honouring the Retry-After header
+def get_retry_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    # Exponential backoff with jitter, so parallel workers do not retry in lockstep
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** attempt)
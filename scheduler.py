@@ -0,0 +1,58 @@
+import os
+import random
+import time
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', '4'))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', '300'))
+# Factor the interval grows by after each cycle without changes
+POLL_BACKOFF = float(os.getenv('POLL_BACKOFF', '1.5'))
+# Random spread applied to each interval, as a fraction of it
+POLL_JITTER = float(os.getenv('POLL_JITTER', '0.1'))
+
+# Polling interval that widens while nothing changes and snaps back on activity
+class AdaptiveInterval:
+    def __init__(self, name, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL, backoff=POLL_BACKOFF, jitter=POLL_JITTER):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = min_interval
+        self.cycles = 0
+        self.hits = 0
+
+    def record(self, changed):
+        self.cycles += 1
+        if changed:
+            self.hits += 1
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def next_delay(self):
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def hit_rate(self):
+        return self.hits / self.cycles if self.cycles else 0.0
+
+    def describe(self, delay):
+        return f"{self.name}: next poll in {delay:.1f}s, {self.hits}/{self.cycles} polls found changes ({self.hit_rate():.0%})"
+
+# Function to poll each (interval, phase) job on its own schedule forever
+# Each phase returns True when it found changes
+def poll_forever(jobs, report=print):
+    next_runs = [time.monotonic()] * len(jobs)
+    while True:
+        index = min(range(len(jobs)), key=next_runs.__getitem__)
+        time.sleep(max(0.0, next_runs[index] - time.monotonic()))
+
+        interval, phase = jobs[index]
+        interval.record(bool(phase()))
+        delay = interval.next_delay()
+        next_runs[index] = time.monotonic() + delay
+        report(interval.describe(delay))
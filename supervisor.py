@@ -0,0 +1,260 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration
+# JSON file listing the Notion database and Todoist account pairs to sync
+WORKSPACES_FILE = os.getenv('WORKSPACES_FILE', 'workspaces.json')
+# Folder holding one state folder per workspace
+STATE_DIR = os.path.abspath(os.getenv('STATE_DIR', 'workspaces'))
+# Number of worker processes, defaults to one per CPU
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '0')) or os.cpu_count() or 1
+# Seconds between checks of whether workspaces should move to another worker
+REBALANCE_INTERVAL = float(os.getenv('REBALANCE_INTERVAL', '600'))
+# How far above the average a worker's load may be before workspaces are moved
+REBALANCE_THRESHOLD = float(os.getenv('REBALANCE_THRESHOLD', '1.25'))
+
+# Function to read the workspaces from the config file
+def load_workspaces(file_path=WORKSPACES_FILE):
+    with open(file_path, 'r') as file:
+        workspaces = json.load(file)
+    names = set()
+    for workspace in workspaces:
+        missing = [key for key in ('name', 'notion_api_token', 'notion_database_id', 'todoist_api_token') if not workspace.get(key)]
+        if missing:
+            print(f"Error: A workspace in {file_path} is missing {', '.join(missing)}.")
+            sys.exit(4)
+        if workspace['name'] in names:
+            print(f"Error: The workspace name '{workspace['name']}' is used twice in {file_path}.")
+            sys.exit(4)
+        names.add(workspace['name'])
+    return workspaces
+
+# Function to assign workspaces to workers so that their loads are even
+# Workspaces stay on their worker unless it would end up above the allowed load
+def plan_shards(loads, assignment, worker_count, threshold=REBALANCE_THRESHOLD):
+    worker_loads = [0.0] * worker_count
+    for name, worker in assignment.items():
+        worker_loads[worker] += loads.get(name, 0.0)
+    allowed = sum(loads.values()) / worker_count * threshold
+    if all(worker in range(worker_count) for worker in assignment.values()) and max(worker_loads) <= allowed:
+        return dict(assignment)
+
+    # Longest processing time first: hand out the busiest workspaces first
+    new_loads = [0.0] * worker_count
+    plan = {}
+    for name in sorted(loads, key=loads.get, reverse=True):
+        worker = assignment.get(name)
+        if worker is None or worker >= worker_count or new_loads[worker] + loads[name] > allowed:
+            worker = min(range(worker_count), key=new_loads.__getitem__)
+        plan[name] = worker
+        new_loads[worker] += loads[name]
+    # Moving workspaces costs their in-memory state, only do it when it helps
+    if max(new_loads) >= max(worker_loads):
+        return dict(assignment)
+    return plan
+
+# Writes every line printed while a workspace syncs with the workspace's name in front
+class PrefixedOutput:
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+        self.at_line_start = True
+
+    def write(self, text):
+        for line in text.splitlines(True):
+            if self.at_line_start:
+                self.stream.write(self.prefix)
+            self.stream.write(line)
+            self.at_line_start = line.endswith('\n')
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+# One workspace as seen by the worker that syncs it
+class Workspace:
+    def __init__(self, config):
+        from http_client import create_rate_buckets
+        from scheduler import AdaptiveInterval
+
+        self.config = config
+        self.name = config['name']
+        self.directory = os.path.abspath(os.path.join(STATE_DIR, self.name))
+        os.makedirs(self.directory, exist_ok=True)
+        # Each account gets its own rate-limit budget
+        self.rate_buckets = create_rate_buckets()
+        self.interval = AdaptiveInterval(self.name)
+        self.next_run = time.monotonic()
+        # Notion changes that could not be sent yet, kept while other workspaces sync
+        self.notion_write_buffer = {}
+        self.paused = False
+
+    # Run one Notion and one Todoist phase for this workspace, returns True if tasks changed
+    def run_cycle(self):
+        import helper
+        from Notion_to_Local import sync_notion_to_json
+        from Todoist_to_Local import sync_todoist_to_json
+        from http_client import use_rate_buckets
+        from main import run_phase
+
+        helper.configure_workspace(self.config['notion_api_token'], self.config['notion_database_id'], self.config['todoist_api_token'])
+        use_rate_buckets(self.rate_buckets)
+        helper.notion_write_buffer.update(self.notion_write_buffer)
+        # State files are opened relative to the working folder
+        os.chdir(self.directory)
+        helper.begin_cycle()
+        try:
+            with contextlib.redirect_stdout(PrefixedOutput(f"[{self.name}] ", sys.stdout)):
+                changed = run_phase("Notion_to_Local", sync_notion_to_json)
+                changed = run_phase("Todoist_to_Local", sync_todoist_to_json) or changed
+        except SystemExit:
+            # Invalid credentials only stop this workspace, not the others in the worker
+            print(f"[{self.name}] Invalid credentials, this workspace is paused until the supervisor restarts.")
+            self.paused = True
+            changed = False
+        finally:
+            self.notion_write_buffer = dict(helper.notion_write_buffer)
+            helper.notion_write_buffer.clear()
+            helper.notion_known_properties.clear()
+        return changed
+
+    # Drop everything this worker keeps in memory for the workspace
+    def close(self):
+        import helper
+        from journal import close_journals
+
+        helper.forget_files(self.directory)
+        close_journals(self.directory)
+
+# Function run by each worker process: sync the assigned workspaces on their own intervals
+def run_worker(worker, commands, reports):
+    try:
+        sync_workspaces(worker, commands, reports)
+    except KeyboardInterrupt:
+        # The supervisor handles Ctrl+C and stops the workers
+        pass
+
+def sync_workspaces(worker, commands, reports):
+    workspaces = {}
+    while True:
+        active = [workspace for workspace in workspaces.values() if not workspace.paused]
+        next_run = min((workspace.next_run for workspace in active), default=time.monotonic() + 60)
+        try:
+            # Assignments from the supervisor are handled between cycles
+            command, argument = commands.get(timeout=max(0.0, next_run - time.monotonic()))
+        except queue.Empty:
+            command = None
+
+        if command == 'add':
+            workspaces[argument['name']] = Workspace(argument)
+            continue
+        if command == 'remove':
+            workspace = workspaces.pop(argument, None)
+            if workspace:
+                workspace.close()
+            reports.put(('removed', argument, worker))
+            continue
+        if command == 'stop':
+            return
+        if not active:
+            continue
+
+        workspace = min(active, key=lambda workspace: workspace.next_run)
+        start = time.monotonic()
+        changed = workspace.run_cycle()
+        elapsed = time.monotonic() - start
+        workspace.interval.record(changed)
+        workspace.next_run = time.monotonic() + workspace.interval.next_delay()
+        reports.put(('cycle', workspace.name, elapsed))
+
+# Function to sync every workspace in the config file, spread over a pool of worker processes
+def run_supervisor():
+    configs = {config['name']: config for config in load_workspaces()}
+    worker_count = min(WORKER_PROCESSES, len(configs))
+    if not worker_count:
+        print(f"Error: {WORKSPACES_FILE} does not list any workspaces.")
+        sys.exit(4)
+
+    # Workers start from a fresh interpreter instead of a copy of this one
+    context = multiprocessing.get_context('spawn')
+    reports = context.Queue()
+    commands = [context.Queue() for _ in range(worker_count)]
+    processes = [None] * worker_count
+
+    def start_worker(worker):
+        processes[worker] = context.Process(target=run_worker, args=(worker, commands[worker], reports), daemon=True)
+        processes[worker].start()
+
+    # Spread the workspaces evenly to begin with
+    assignment = {name: index % worker_count for index, name in enumerate(configs)}
+    for worker in range(worker_count):
+        start_worker(worker)
+    for name, worker in assignment.items():
+        commands[worker].put(('add', configs[name]))
+    print(f"Syncing {len(configs)} workspaces with {worker_count} workers...")
+
+    # Seconds each workspace spent syncing since the last rebalance
+    loads = dict.fromkeys(configs, 0.0)
+    # Workspaces on their way to another worker, as (old worker, new worker) by name.
+    # They are only added to the new worker once the old one has let go of them
+    moves = {}
+    next_rebalance = time.monotonic() + REBALANCE_INTERVAL
+    try:
+        while True:
+            try:
+                report = reports.get(timeout=max(0.0, min(5.0, next_rebalance - time.monotonic())))
+            except queue.Empty:
+                report = None
+
+            if report and report[0] == 'cycle':
+                loads[report[1]] += report[2]
+            elif report and report[0] == 'removed' and report[1] in moves:
+                old_worker, new_worker = moves.pop(report[1])
+                commands[new_worker].put(('add', configs[report[1]]))
+
+            # Restart crashed workers with the workspaces they had
+            for worker, process in enumerate(processes):
+                if not process.is_alive():
+                    print(f"Worker {worker} stopped with exit code {process.exitcode}, restarting it...")
+                    start_worker(worker)
+                    for name, assigned in assignment.items():
+                        if assigned == worker and name not in moves:
+                            commands[worker].put(('add', configs[name]))
+                    # Workspaces it was handing over are free to move now
+                    for name, (old_worker, new_worker) in list(moves.items()):
+                        if old_worker == worker:
+                            del moves[name]
+                            commands[new_worker].put(('add', configs[name]))
+
+            if time.monotonic() < next_rebalance:
+                continue
+            next_rebalance = time.monotonic() + REBALANCE_INTERVAL
+            plan = plan_shards(loads, assignment, worker_count)
+            for name, worker in plan.items():
+                if worker != assignment[name] and name not in moves:
+                    print(f"Moving workspace '{name}' from worker {assignment[name]} to worker {worker}.")
+                    moves[name] = (assignment[name], worker)
+                    commands[assignment[name]].put(('remove', name))
+            assignment = plan
+            loads = dict.fromkeys(configs, 0.0)
+    except KeyboardInterrupt:
+        for worker_commands in commands:
+            worker_commands.put(('stop', None))
+        for process in processes:
+            process.join(timeout=10)
+        raise
+
+if __name__ == "__main__":
+    try:
+        run_supervisor()
+    except KeyboardInterrupt:
+        print("Exiting gracefully...")
@@ -0,0 +1,121 @@
+import sys
+from datetime import datetime, timezone
+
+# Function to turn an ISO 8601 timestamp into seconds since the epoch
+# Timestamps without an offset are taken to be in UTC
+def parse_timestamp(value):
+    timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+# A local task, shared by Notion_to_Local, Todoist_to_Local and Sync.
+# Slots keep 100k tasks far smaller than the same tasks as dicts
+class Task:
+    __slots__ = (
+        'notion_id', 'todoist_id', 'name', 'completed', 'due_date', 'labels', 'deleted',
+        'last_modified', 'modified_at', 'notion_hash', 'todoist_hash',
+        'version', 'changed_by', 'notion_version', 'todoist_version'
+    )
+
+    notion_id: str
+    todoist_id: 'str | int | None'
+    name: str
+    completed: bool
+    due_date: 'str | None'
+    labels: list
+    deleted: bool
+    # As saved, in whatever offset the task was written with
+    last_modified: str
+    # last_modified in seconds since the epoch, for comparing timestamps with different offsets
+    modified_at: float
+    # Fingerprints of the synced fields as last read from each side
+    notion_hash: 'str | None'
+    todoist_hash: 'str | None'
+    # Versions are None for tasks saved before they were tracked
+    version: 'int | None'
+    changed_by: 'str | None'
+    notion_version: 'int | None'
+    todoist_version: 'int | None'
+
+    def __init__(self, notion_id, todoist_id=None, name='', completed=False, due_date=None, labels=None, deleted=False, notion_hash=None):
+        self.notion_id = notion_id
+        self.todoist_id = todoist_id
+        self.name = name
+        self.completed = completed
+        self.due_date = due_date
+        self.labels = labels if labels is not None else []
+        self.deleted = deleted
+        self.notion_hash = notion_hash
+        self.todoist_hash = None
+        self.version = None
+        self.changed_by = None
+        self.notion_version = None
+        self.todoist_version = None
+        self.touch()
+
+    def __repr__(self):
+        return f'Task({self.notion_id!r}, {self.name!r})'
+
+    # Record that the task changed just now
+    def touch(self):
+        now = datetime.now(timezone.utc)
+        self.last_modified = now.isoformat()
+        self.modified_at = now.timestamp()
+
+    # Version of the task last synced to a side, 'notion' or 'todoist'
+    def get_side_version(self, side):
+        return (self.notion_version if side == 'notion' else self.todoist_version) or 0
+
+    def set_side_version(self, side, version):
+        if side == 'notion':
+            self.notion_version = version
+        else:
+            self.todoist_version = version
+
+    # Build a task from its saved form, with hyphenated keys such as 'notion-id'
+    @classmethod
+    def from_dict(cls, data):
+        task = cls.__new__(cls)
+        get = data.get
+        task.notion_id = data['notion-id']
+        task.todoist_id = get('todoist-id')
+        task.name = data['name']
+        task.completed = data['completed']
+        task.due_date = get('due_date')
+        # Label names repeat across tasks, so every task shares one copy of each
+        task.labels = [sys.intern(label) for label in data['labels']]
+        task.deleted = get('deleted', False)
+        task.last_modified = data['last_modified']
+        task.modified_at = parse_timestamp(task.last_modified)
+        task.notion_hash = get('notion-hash')
+        task.todoist_hash = get('todoist-hash')
+        task.version = get('version')
+        changed_by = get('changed-by')
+        task.changed_by = sys.intern(changed_by) if changed_by else None
+        task.notion_version = get('notion-version')
+        task.todoist_version = get('todoist-version')
+        return task
+
+    # Turn the task back into its saved form, leaving out the fields that are not set
+    def to_dict(self):
+        data = {
+            'notion-id': self.notion_id,
+            'todoist-id': self.todoist_id,
+            'name': self.name,
+            'completed': self.completed,
+            'due_date': self.due_date,
+            'labels': self.labels,
+            'deleted': self.deleted,
+            'last_modified': self.last_modified
+        }
+        if self.notion_hash is not None:
+            data['notion-hash'] = self.notion_hash
+        if self.todoist_hash is not None:
+            data['todoist-hash'] = self.todoist_hash
+        if self.version is not None:
+            data['version'] = self.version
+            data['changed-by'] = self.changed_by
+            data['notion-version'] = self.notion_version or 0
+            data['todoist-version'] = self.todoist_version or 0
+        return data
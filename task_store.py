@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+from dotenv import load_dotenv
+from task_model import Task
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Which store keeps the local tasks: 'json' or 'sqlite'
+TASK_STORE = os.getenv('TASK_STORE', 'json').lower()
+# How the JSON store encodes its file: 'pretty', 'compact' or 'msgpack'
+TASKS_ENCODING = os.getenv('TASKS_ENCODING', 'pretty').lower()
+
+# First bytes of a msgpack array: fixarray, array 16 and array 32
+MSGPACK_ARRAY_MARKERS = set(range(0x90, 0xa0)) | {0xdc, 0xdd}
+
+# Function to replace a file in one step, so a crash leaves either the old or the new file
+def write_file_atomically(filename, data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    with open(filename + '.tmp', 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(filename + '.tmp', filename)
+
+# Function to write a small JSON document, such as a sync state file, atomically
+def save_json_atomically(filename, data):
+    write_file_atomically(filename, json.dumps(data))
+
+# Store that keeps every task in a single JSON file
+class JsonTaskStore:
+    def __init__(self, filename):
+        self.filename = filename
+        self.encoding = TASKS_ENCODING
+        if self.encoding == 'msgpack' and msgpack is None:
+            print("TASKS_ENCODING is msgpack but the msgpack package is not installed, using compact JSON instead.")
+            self.encoding = 'compact'
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+        # The encoding is detected from the data, so changing TASKS_ENCODING keeps old files readable
+        # Each record becomes a Task as soon as it is decoded, so the dicts never pile up
+        first_byte = data.lstrip()[:1]
+        if not first_byte:
+            # An empty file holds no tasks
+            return []
+        if first_byte == b'[':
+            return json.loads(data, object_hook=Task.from_dict)
+        if first_byte[0] not in MSGPACK_ARRAY_MARKERS:
+            print(f"{self.filename} is neither JSON nor msgpack, move it away to start with no tasks.")
+            sys.exit(5)
+        if msgpack is None:
+            print(f"{self.filename} is encoded with msgpack, install the msgpack package to read it.")
+            sys.exit(5)
+        return msgpack.unpackb(data, object_hook=Task.from_dict)
+
+    # The whole file is rewritten, whichever tasks changed
+    def save(self, tasks, changed_tasks, removed_ids):
+        tasks = [task.to_dict() for task in tasks]
+        if self.encoding == 'msgpack':
+            data = msgpack.packb(tasks, default=str)
+        elif self.encoding == 'compact':
+            data = json.dumps(tasks, ensure_ascii=False, separators=(',', ':'), default=str)
+        else:
+            data = json.dumps(tasks, ensure_ascii=False, indent=2, default=str)
+        write_file_atomically(self.filename, data)
+
+# Store that keeps one row per task in an SQLite database, so only changed rows are written
+class SqliteTaskStore:
+    def __init__(self, filename):
+        import sqlite3
+
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            # notion_id is the primary key, so it is indexed already
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    notion_id TEXT PRIMARY KEY,
+                    todoist_id TEXT,
+                    last_modified TEXT,
+                    data TEXT NOT NULL
+                )
+            ''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS tasks_todoist_id ON tasks (todoist_id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS tasks_last_modified ON tasks (last_modified)')
+
+    def load(self):
+        rows = self.connection.execute('SELECT data FROM tasks ORDER BY rowid')
+        return [Task.from_dict(json.loads(data)) for data, in rows]
+
+    def is_empty(self):
+        return self.connection.execute('SELECT 1 FROM tasks LIMIT 1').fetchone() is None
+
+    # Changed tasks are upserted and removed ones deleted in a single transaction
+    def save(self, tasks, changed_tasks, removed_ids):
+        with self.connection:
+            self.connection.executemany('''
+                INSERT INTO tasks (notion_id, todoist_id, last_modified, data) VALUES (?, ?, ?, ?)
+                ON CONFLICT (notion_id) DO UPDATE SET
+                    todoist_id = excluded.todoist_id,
+                    last_modified = excluded.last_modified,
+                    data = excluded.data
+            ''', [
+                (task.notion_id, task.todoist_id and str(task.todoist_id), task.last_modified, json.dumps(task.to_dict(), ensure_ascii=False, default=str))
+                for task in changed_tasks
+            ])
+            self.connection.executemany('DELETE FROM tasks WHERE notion_id = ?', [(notion_id,) for notion_id in removed_ids])
+
+    # One-time import of an existing JSON task file into an empty database
+    def import_json(self, json_filename):
+        tasks = JsonTaskStore(json_filename).load()
+        self.save(tasks, tasks, [])
+        print(f"Imported {len(tasks)} tasks from {json_filename} into {self.filename}.")
+
+# Function to open the configured store for a task file such as 'tasks.json'
+def open_task_store(filename):
+    if TASK_STORE == 'sqlite':
+        store = SqliteTaskStore(os.path.splitext(filename)[0] + '.db')
+        if store.is_empty() and os.path.exists(filename):
+            store.import_json(filename)
+        return store
+    return JsonTaskStore(filename)
@@ -0,0 +1,49 @@
+"""Shared fixtures: a fake Notion and Todoist server and a clean state folder per test."""
+import os
+import sys
+import threading
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO, os.path.join(REPO, 'benchmarks')]
+
+import fake_servers
+
+# The sync modules read their settings when they are imported, so the server
+# has to be listening and the environment set before any test imports them
+server = fake_servers.make_server(0)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+API_URL = f'http://127.0.0.1:{server.server_address[1]}'
+os.environ.update(
+    NOTION_API_URL=f'{API_URL}/v1',
+    TODOIST_API_URL=API_URL,
+    NOTION_DATABASE_ID=fake_servers.DATABASE_ID,
+    NOTION_API_TOKEN='test',
+    TODOIST_API_TOKEN='test',
+    NOTION_RATE_LIMIT='100000',
+    NOTION_RATE_BURST='100000',
+    TODOIST_RATE_LIMIT='100000',
+    TODOIST_RATE_BURST='100000',
+    TASK_STORE='json',
+    TASKS_ENCODING='pretty',
+)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """Return a function that fills the fake servers with ``tasks`` tasks, in a fresh state folder."""
+    import Sync
+    import helper
+    import journal
+
+    monkeypatch.chdir(tmp_path)
+    yield lambda tasks=0: setattr(server.RequestHandlerClass, 'workspace', fake_servers.FakeWorkspace(tasks))
+
+    # Forget everything kept in memory for this test's state folder
+    helper.forget_files(tmp_path)
+    journal.close_journals(tmp_path)
+    helper.begin_cycle()
+    helper.notion_write_buffer.clear()
+    helper.notion_known_properties.clear()
+    Sync.todoist_command_queue.clear()
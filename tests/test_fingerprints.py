@@ -0,0 +1,58 @@
+import requests
+
+import helper
+from conftest import API_URL
+from Notion_to_Local import sync_notion_to_json
+from Todoist_to_Local import apply_todoist_item, sync_todoist_to_json
+from fake_servers import FIRST_TODOIST_ID, notion_page_id
+from task_model import Task
+
+# Task 2 has no due date, so its Notion fingerprint does not depend on how dates are written back
+PAGE_ID = notion_page_id(2)
+ITEM_ID = str(FIRST_TODOIST_ID + 2)
+
+
+def get_names():
+    page = requests.get(f'{API_URL}/v1/pages/{PAGE_ID}').json()
+    item = requests.get(f'{API_URL}/rest/v2/tasks').json()
+    local = helper.load_tasks_from_json('tasks.json')
+    return (
+        page['properties']['Name']['title'][0]['plain_text'],
+        next(task['content'] for task in item if task['id'] == ITEM_ID),
+        next(task.name for task in local if task.notion_id == PAGE_ID),
+    )
+
+
+def test_edit_back_to_the_pushed_over_value_is_synced(workspace):
+    workspace(3)
+    sync_notion_to_json()
+    sync_todoist_to_json()
+    assert get_names() == ('Task 2', 'Task 2', 'Task 2')
+
+    # Renamed in Todoist, then Sync writes the new name to Notion
+    requests.post(f'{API_URL}/rest/v2/tasks/{ITEM_ID}', json={'content': 'Renamed'})
+    sync_todoist_to_json()
+    assert get_names() == ('Renamed', 'Renamed', 'Renamed')
+
+    # Renamed back in Notion before the write above was read from Notion
+    requests.patch(f'{API_URL}/v1/pages/{PAGE_ID}', json={'properties': {'Name': {'title': [{'text': {'content': 'Task 2'}}]}}})
+    assert sync_notion_to_json()
+    assert get_names() == ('Task 2', 'Task 2', 'Task 2')
+
+
+def test_push_clears_the_fingerprint_of_the_side_written_to(workspace):
+    task = Task('page', 1, 'Name', notion_hash='notion')
+    task.todoist_hash = 'todoist'
+    helper.mark_task_synced(task, 'notion', 1)
+    assert (task.notion_hash, task.todoist_hash) == (None, 'todoist')
+    helper.mark_task_synced(task, 'todoist', 1)
+    assert task.todoist_hash is None
+
+
+def test_new_fingerprint_is_saved(workspace):
+    task = Task('page', 1, 'Name')
+    item = {'id': '1', 'content': 'Name', 'labels': [], 'due': None}
+    # Nothing synced changed, but the fingerprint did and has to be written
+    assert not apply_todoist_item(task, item)
+    assert task.todoist_hash is not None
+    assert helper.dirty_tasks[helper.os.path.abspath('tasks.json')] == {'page': task}
@@ -0,0 +1,34 @@
+import json
+
+import helper
+from Notion_to_Local import get_notion_sync_state, sync_notion_to_json
+from task_model import Task
+
+
+def save_local_tasks(*tasks):
+    with open('tasks.json', 'w') as file:
+        json.dump([task.to_dict() for task in tasks], file)
+
+
+def test_empty_full_scan_deletes_nothing(workspace, capsys):
+    workspace(0)
+    save_local_tasks(Task('missing', 1000, 'Kept'))
+
+    assert not sync_notion_to_json()
+
+    assert 'returned no tasks' in capsys.readouterr().out
+    assert [task.deleted for task in helper.load_tasks_from_json('tasks.json')] == [False]
+    # The scan is still recorded, so it is not repeated every cycle
+    assert 'last_full_scan' in get_notion_sync_state()
+
+
+def test_full_scan_deletes_tasks_missing_from_notion(workspace):
+    workspace(2)
+    save_local_tasks(Task('missing', 5000, 'Gone'))
+
+    assert sync_notion_to_json()
+
+    # Sync removes deleted tasks from the file once both sides are updated
+    tasks = helper.load_tasks_from_json('tasks.json')
+    assert 'missing' not in {task.notion_id for task in tasks}
+    assert len(tasks) == 2
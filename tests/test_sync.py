@@ -0,0 +1,54 @@
+import requests
+
+import Sync
+from conftest import API_URL
+from journal import get_journal
+from task_model import Task
+
+
+def begin_item_add(task, content):
+    command = {'type': 'item_add', 'uuid': f'uuid-{content}', 'temp_id': f'temp-{content}', 'args': {'content': content, 'labels': []}}
+    get_journal().begin([{'key': command['uuid'], 'command': command, 'notion-id': task.notion_id}])
+    return command
+
+
+def get_item_ids(content):
+    return [item['id'] for item in requests.get(f'{API_URL}/rest/v2/tasks').json() if item['content'] == content]
+
+
+def test_replay_recovers_id_of_item_todoist_already_created(workspace):
+    workspace(0)
+    task = Task('page', None, 'Created')
+    command = begin_item_add(task, 'Created')
+    # Todoist applied the command, but the run stopped before the answer was saved
+    requests.post(f'{API_URL}/sync/v9/sync', json={'commands': [command]})
+
+    assert Sync.replay_todoist_journal([task]) == [task]
+
+    # The same uuid gets the first result back instead of a second item
+    assert get_item_ids('Created') == [task.todoist_id]
+    assert get_journal().get_pending() == []
+
+
+def test_replay_creates_item_todoist_never_received(workspace):
+    workspace(0)
+    task = Task('page', None, 'Lost')
+    begin_item_add(task, 'Lost')
+
+    assert Sync.replay_todoist_journal([task]) == [task]
+    assert get_item_ids('Lost') == [task.todoist_id]
+
+
+def test_task_with_failed_close_stays_stale(workspace, monkeypatch):
+    task = Task('page', '1', 'Done', completed=True)
+    task.version = 2
+    Sync.sync_todoist_task(task)
+    # The update succeeds in one batch and the close fails in the next
+    monkeypatch.setattr(Sync, 'TODOIST_COMMAND_BATCH_SIZE', 1)
+    monkeypatch.setattr(Sync, 'post_todoist_commands', lambda commands: {'sync_status': {
+        command['uuid']: 'ok' if command['type'] == 'item_update' else {'error': 'Failed'} for command in commands
+    }})
+
+    Sync.flush_todoist_commands()
+
+    assert Sync.is_task_stale(task, 'todoist')
@@ -0,0 +1,63 @@
+import pytest
+
+import task_store
+from task_store import JsonTaskStore, SqliteTaskStore
+from task_model import Task
+
+
+def make_tasks():
+    first = Task('page-1', '1001', 'First', False, '2024-01-31T09:30:00+08:00', ['Work'], notion_hash='abc')
+    first.version = 2
+    first.set_side_version('notion', 2)
+    return [first, Task('page-2', None, 'Zweite Aufgabe ✓', True)]
+
+
+def assert_same_tasks(loaded, tasks):
+    assert [task.to_dict() for task in loaded] == [task.to_dict() for task in tasks]
+
+
+@pytest.mark.parametrize('encoding', ['pretty', 'compact', 'msgpack'])
+def test_json_store_round_trip(tmp_path, monkeypatch, encoding):
+    if encoding == 'msgpack':
+        pytest.importorskip('msgpack')
+    monkeypatch.setattr(task_store, 'TASKS_ENCODING', encoding)
+    store = JsonTaskStore(str(tmp_path / 'tasks.json'))
+    tasks = make_tasks()
+    store.save(tasks, tasks, [])
+    assert_same_tasks(JsonTaskStore(store.filename).load(), tasks)
+
+
+@pytest.mark.parametrize('data', [b'', b'  \n'])
+def test_json_store_reads_empty_file_as_no_tasks(tmp_path, data):
+    (tmp_path / 'tasks.json').write_bytes(data)
+    assert JsonTaskStore(str(tmp_path / 'tasks.json')).load() == []
+
+
+def test_json_store_refuses_unknown_data(tmp_path):
+    (tmp_path / 'tasks.json').write_bytes(b'not tasks')
+    with pytest.raises(SystemExit) as exit_info:
+        JsonTaskStore(str(tmp_path / 'tasks.json')).load()
+    assert exit_info.value.code == 5
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = SqliteTaskStore(str(tmp_path / 'tasks.db'))
+    tasks = make_tasks()
+    store.save(tasks, tasks, [])
+
+    # Only the changed and removed rows are written
+    tasks[1].name = 'Renamed'
+    store.save(tasks, [tasks[1]], ['page-1'])
+
+    assert_same_tasks(SqliteTaskStore(store.filename).load(), tasks[1:])
+
+
+def test_sqlite_store_imports_json_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_store, 'TASK_STORE', 'sqlite')
+    tasks = make_tasks()
+    JsonTaskStore(str(tmp_path / 'tasks.json')).save(tasks, tasks, [])
+
+    store = task_store.open_task_store(str(tmp_path / 'tasks.json'))
+
+    assert isinstance(store, SqliteTaskStore)
+    assert_same_tasks(store.load(), tasks)
@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+import metrics
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration
+ENABLE_WEBHOOKS = os.getenv('ENABLE_WEBHOOKS', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '80'))
+# Secrets used to check that events really come from Todoist and Notion
+TODOIST_CLIENT_SECRET = os.getenv('TODOIST_CLIENT_SECRET')
+NOTION_WEBHOOK_SECRET = os.getenv('NOTION_WEBHOOK_SECRET')
+# Seconds to wait for a burst of events to settle, and the longest an event may wait
+WEBHOOK_DEBOUNCE = float(os.getenv('WEBHOOK_DEBOUNCE', '2'))
+WEBHOOK_MAX_DELAY = float(os.getenv('WEBHOOK_MAX_DELAY', '10'))
+# Seconds between full reconciliations while webhooks are enabled
+RECONCILE_INTERVAL = int(os.getenv('RECONCILE_INTERVAL', '300'))
+
+# Collects the IDs of changed tasks and hands them out in debounced batches
+class ChangeQueue:
+    def __init__(self, debounce=WEBHOOK_DEBOUNCE, max_delay=WEBHOOK_MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.changes = {}
+        self.first_event = None
+        self.last_event = None
+
+    def add(self, service, task_id):
+        with self.condition:
+            now = time.monotonic()
+            self.changes.setdefault(service, set()).add(task_id)
+            if self.first_event is None:
+                self.first_event = now
+            self.last_event = now
+            self.condition.notify_all()
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for changes. Returns {service: set of IDs}, empty if none arrived."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.first_event is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {}
+                self.condition.wait(remaining)
+
+            # Let a burst of events settle so they are synced together
+            while True:
+                settle_at = min(self.last_event + self.debounce, self.first_event + self.max_delay)
+                remaining = settle_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            changes = self.changes
+            self.changes = {}
+            self.first_event = None
+            self.last_event = None
+            return changes
+
+# Function to check an HMAC-SHA256 signature of the request body
+def is_valid_signature(secret, body, signature, encoding):
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    expected = base64.b64encode(digest).decode() if encoding == 'base64' else 'sha256=' + digest.hex()
+    return hmac.compare_digest(expected, signature or '')
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    change_queue = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == '/metrics' and metrics.ENABLE_METRICS:
+            metrics.send_metrics(self)
+        else:
+            self.reply(404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            event = json.loads(body or b'{}')
+        except ValueError:
+            event = None
+        if not isinstance(event, dict):
+            self.reply(400)
+            return
+
+        if self.path == '/todoist':
+            if TODOIST_CLIENT_SECRET and not is_valid_signature(TODOIST_CLIENT_SECRET, body, self.headers.get('X-Todoist-Hmac-SHA256'), 'base64'):
+                self.reply(401)
+                return
+            if (event.get('event_name') or '').startswith('item:'):
+                item_id = (event.get('event_data') or {}).get('id')
+                if item_id is None:
+                    # Acknowledged all the same, so the sender does not keep retrying it
+                    print(f"Ignoring Todoist {event['event_name']} event without an item ID")
+                else:
+                    self.change_queue.add('todoist', str(item_id))
+            self.reply(200)
+
+        elif self.path == '/notion':
+            if 'verification_token' in event:
+                # Sent once when the subscription is created, it has to be entered in Notion
+                print(f"Notion webhook verification token: {event['verification_token']}")
+                self.reply(200)
+                return
+            if NOTION_WEBHOOK_SECRET and not is_valid_signature(NOTION_WEBHOOK_SECRET, body, self.headers.get('X-Notion-Signature'), 'hex'):
+                self.reply(401)
+                return
+            entity = event.get('entity') or {}
+            if entity.get('type') == 'page':
+                if entity.get('id') is None:
+                    print(f"Ignoring Notion {event.get('type')} event without a page ID")
+                else:
+                    self.change_queue.add('notion', entity['id'])
+            self.reply(200)
+
+        else:
+            self.reply(404)
+
+# Function to start the webhook receiver in a background thread
+def start_webhook_server(change_queue, port=WEBHOOK_PORT):
+    handler = type('QueuedWebhookHandler', (WebhookHandler,), {'change_queue': change_queue})
+    server = ThreadingHTTPServer(('', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server